@@ -2,16 +2,25 @@
 Complete enhanced memory storage with improved MemoryEnhancer integration
 Builds on your implementation with additional improvements
 """
-from processing_pipeline import ProcessingStep, ProcessingContext
+from processing_pipeline import ProcessingStep, ProcessingContext, get_shared_enhancer
 from memory_enhancer_improved import ImprovedMemoryEnhancer
 from memory_extractors import SemanticFactExtractor, SkillsExtractor
 import time
 import json
+import logging
 import re
 
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
 class CompleteEnhancedMemoryStorageStep(ProcessingStep):
     """Complete enhanced memory storage with all improvements integrated"""
     
+    __slots__ = ("storage", "embeddings", "kg", "llm_caller", "memory_enhancer",
+                 "semantic_extractor", "skills_extractor", "conversation_buffer",
+                 "reflection_counter", "stats")
+    post_response = True
+    
     def __init__(self, storage_module, embeddings_module, kg=None, llm_caller=None):
         self.storage = storage_module
         self.embeddings = embeddings_module
@@ -19,7 +28,7 @@ class CompleteEnhancedMemoryStorageStep(ProcessingStep):
         self.llm_caller = llm_caller  # For intelligent reflection generation
         
         # Use improved memory enhancer
-        self.memory_enhancer = ImprovedMemoryEnhancer(storage_module, embeddings_module, kg)
+        self.memory_enhancer = get_shared_enhancer(ImprovedMemoryEnhancer, storage_module, embeddings_module, kg)
         
         # Additional extractors for direct use
         self.semantic_extractor = SemanticFactExtractor()
@@ -47,8 +56,9 @@ class CompleteEnhancedMemoryStorageStep(ProcessingStep):
         """Process with complete memory system integration"""
         try:
             # 1. Store episodic memory
-            user_id = self._store_episodic("user", context.user_input)
-            agent_id = self._store_episodic("assistant", context.response)
+            user_emb, agent_emb = self.embeddings.embed_texts([context.user_input, context.response])
+            user_id = self._store_episodic("user", context.user_input, user_emb)
+            agent_id = self._store_episodic("assistant", context.response, agent_emb)
             
             # 2. Use improved MemoryEnhancer for coordinated extraction
             memory_results = self.memory_enhancer.process_conversation(
@@ -101,17 +111,16 @@ class CompleteEnhancedMemoryStorageStep(ProcessingStep):
             if self.reflection_counter % 50 == 0:
                 self.memory_enhancer.clear_cache()
             
-        except Exception as e:
-            print(f"Complete memory storage error: {e}")
-            import traceback
-            traceback.print_exc()
+        except Exception:
+            logger.exception("Complete memory storage error")
         
         return context
     
-    def _store_episodic(self, role: str, text: str) -> int:
+    def _store_episodic(self, role: str, text: str, embedding=None) -> int:
         """Store episodic memory with embedding"""
         memory_id = self.storage.insert_episodic(role, text)
-        embedding = self.embeddings.embed_text(text)
+        if embedding is None:
+            embedding = self.embeddings.embed_text(text)
         self.storage.upsert_vector("episodic", memory_id, embedding)
         
         # Add to conversation buffer for reflection
@@ -134,35 +143,43 @@ class CompleteEnhancedMemoryStorageStep(ProcessingStep):
         if not context.extracted_knowledge or not self.kg:
             return 0
         
+        # Collect each entity once (last write wins) so the KG sees one batched upsert
+        entities = {}
+        pending_relations = []
         for item in context.extracted_knowledge:
             entity = item.get("entity", "").strip()
             etype = item.get("type", "entity")
             relation = item.get("relation", "related_to")
             target = item.get("target", "user")
-            replaces = item.get("replaces", False)
             
             if entity and relation:
                 # Enhanced entity creation with attributes
-                entity_attrs = self._extract_entity_attributes(entity, etype)
-                self.kg.upsert_entity(entity, etype, **entity_attrs)
-                
-                target_attrs = {"type": "person"} if target == "user" else {}
-                self.kg.upsert_entity(target, "person", **target_attrs)
-                
-                # Handle replacement intelligently
-                if replaces:
-                    # Remove old relations of this type
-                    self.kg.update_relation(target, relation, entity)
-                    print(f"   Updated: {target} {relation} {entity}")
-                else:
-                    # Add new relation with confidence
-                    confidence = item.get("confidence", 1.0)
-                    self.kg.upsert_relation(target, relation, entity, weight=confidence)
-                
-                updates += 1
-                
-                # Also store as searchable fact
-                self._store_relation_as_fact(target, relation, entity)
+                entities[entity] = (etype, self._extract_entity_attributes(entity, etype))
+                entities[target] = ("person", {"type": "person"} if target == "user" else {})
+                pending_relations.append(item | {"entity": entity, "target": target, "relation": relation})
+        
+        if pending_relations:
+            self.kg.upsert_entities_many(
+                (name, etype, attrs) for name, (etype, attrs) in entities.items()
+            )
+        
+        for item in pending_relations:
+            entity, relation, target = item["entity"], item["relation"], item["target"]
+            
+            # Handle replacement intelligently
+            if item.get("replaces", False):
+                # Remove old relations of this type
+                self.kg.update_relation(target, relation, entity)
+                print(f"   Updated: {target} {relation} {entity}")
+            else:
+                # Add new relation with confidence
+                confidence = item.get("confidence", 1.0)
+                self.kg.upsert_relation(target, relation, entity, weight=confidence)
+            
+            updates += 1
+            
+            # Also store as searchable fact
+            self._store_relation_as_fact(target, relation, entity)
         
         return updates
     
@@ -262,18 +279,20 @@ class CompleteEnhancedMemoryStorageStep(ProcessingStep):
                 "names": self._extract_proper_nouns(message)
             }
             
-            # Store extracted information with context
+            # Store extracted information with context: one embedding call and one transaction.
+            # Repeated matches (e.g. the same name in several results) are stored and embedded once.
+            facts = {}
             for data_type, values in extracted_data.items():
                 for value in values[:3]:  # Limit to top 3 per type
                     fact_key = f"search_{data_type}_{query[:30].replace(' ', '_')}_{value[:20]}"
-                    fact_id = self.storage.insert_semantic(
-                        fact_key,
-                        value,
-                        f"web_search_{data_type}"
-                    )
-                    fact_emb = self.embeddings.embed_text(f"{query}: {value}")
-                    self.storage.upsert_vector("semantic", fact_id, fact_emb)
-                    results_stored += 1
+                    facts.setdefault((fact_key, value, f"web_search_{data_type}"), f"{query}: {value}")
+            if facts:
+                rows = list(facts)
+                fact_embs = self.embeddings.embed_texts(list(facts.values()))
+                with self.storage.transaction():
+                    fact_ids = self.storage.insert_semantic_many(rows)
+                    self.storage.upsert_vectors_many("semantic", list(zip(fact_ids, fact_embs)))
+                results_stored += len(rows)
             
             # Store search summary as skill/observation
             if results_stored > 0:
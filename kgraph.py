@@ -1,29 +1,59 @@
 import networkx as nx
+import numpy as np
 import time
 import storage
 
 class KnowledgeGraph:
     def __init__(self):
         self.G = nx.MultiDiGraph()
+        # Bumped on every write so readers can tell when cached query results are stale
+        self.version = 0
+        # Materialized get_related_concepts results: name -> (entity generation, max_out, rels);
+        # a write touching an entity bumps its generation, which invalidates its summary
+        self._related_cache = {}
+        self._entity_gen = {}
+        # Lowercased node names/types as numpy arrays for vectorized search; rebuilt per version
+        self._search_index = None
         self._load_from_storage()
 
     def _load_from_storage(self):
-        for name, etype, attrs, ts in storage.load_kg_entities():
-            self.G.add_node(name, type=etype, **attrs, ts=ts)
-        for subj, pred, obj, weight, attrs, ts in storage.load_kg_relations():
-            self.G.add_edge(subj, obj, key=pred, pred=pred, weight=weight, ts=ts, **attrs)
+        self.G.add_nodes_from(
+            (name, {**attrs, "type": etype, "ts": ts})
+            for name, etype, attrs, ts in storage.load_kg_entities()
+        )
+        self.G.add_edges_from(
+            (subj, obj, pred, {**attrs, "pred": pred, "weight": weight, "ts": ts})
+            for subj, pred, obj, weight, attrs, ts in storage.load_kg_relations()
+        )
 
     def upsert_entity(self, name: str, etype: str = "entity", **attrs):
         # Avoid 'type' conflict with NetworkX by using 'entity_type'
         node_attrs = {**attrs, "entity_type": etype, "ts": time.time()}
         self.G.add_node(name, **node_attrs)
         storage.upsert_kg_entity(name, etype, attrs)
+        self.version += 1
+
+    def upsert_entities_many(self, entities):
+        """Upsert (name, etype, attrs) triples with a single storage transaction"""
+        rows = list(entities)
+        ts = time.time()
+        for name, etype, attrs in rows:
+            self.G.add_node(name, **{**attrs, "entity_type": etype, "ts": ts})
+        storage.upsert_kg_entities_many(rows)
+        self.version += 1
 
     def upsert_relation(self, subj: str, pred: str, obj: str, weight: float=1.0, **attrs):
         self.upsert_entity(subj)
         self.upsert_entity(obj)
         self.G.add_edge(subj, obj, key=pred, pred=pred, weight=weight, **attrs, ts=time.time())
         storage.upsert_kg_relation(subj, pred, obj, weight, attrs)
+        self._touch(subj, obj)
+        self.version += 1
+
+    def _touch(self, *names):
+        """Invalidate the related-concept summaries of entities whose edges changed"""
+        for name in names:
+            self._entity_gen[name] = self._entity_gen.get(name, 0) + 1
 
     # ---- Helpers the agent calls ----
     def search_entities(self, term: str, limit: int = 10):
@@ -33,23 +63,22 @@ class KnowledgeGraph:
             return [name for (name, _, _, _) in rows]
         
         term_l = term.lower()
-        results = []
+        nodes, names_l, types_l, has_type = self._get_search_index()
         
         # Direct name match
-        for n in self.G.nodes:
-            if term_l in str(n).lower():
-                results.append(n)
+        results = [nodes[i] for i in np.flatnonzero(np.char.find(names_l, term_l) >= 0)]
         
         # If no direct matches, try to find related entities
-        if not results:
-            # Look for entities that might be related to the search term
-            for n in self.G.nodes:
-                node_data = self.G.nodes[n]
-                # Check if the search term relates to the entity type or attributes
-                if 'type' in node_data:
-                    entity_type = node_data['type'].lower()
-                    if any(keyword in term_l for keyword in [entity_type, 'favorite', 'like', 'prefer']):
-                        results.append(n)
+        if not results and len(nodes):
+            # Check if the search term relates to the entity type or attributes
+            if any(keyword in term_l for keyword in ('favorite', 'like', 'prefer')):
+                matched = has_type
+            else:
+                # Few distinct types, so test each once and broadcast back to nodes
+                uniq, inverse = np.unique(types_l, return_inverse=True)
+                type_hit = np.array([t in term_l for t in uniq], dtype=bool)
+                matched = has_type & type_hit[inverse]
+            results = [nodes[i] for i in np.flatnonzero(matched)]
         
         # If still no results, try semantic search through relations
         if not results:
@@ -63,13 +92,47 @@ class KnowledgeGraph:
         
         return results[:limit]
 
+    def _get_search_index(self):
+        """(nodes, lowercased names, lowercased types, has-type mask) for the current graph"""
+        key = (self.version, self.G.number_of_nodes())
+        if self._search_index is None or self._search_index[0] != key:
+            nodes = list(self.G.nodes)
+            data = self.G.nodes
+            names_l = np.array([str(n).lower() for n in nodes], dtype=str)
+            has_type = np.array(['type' in data[n] for n in nodes], dtype=bool)
+            types_l = np.array([str(data[n].get('type', '')).lower() for n in nodes], dtype=str)
+            self._search_index = (key, (nodes, names_l, types_l, has_type))
+        return self._search_index[1]
+
     def get_entity_info(self, name: str):
         if name not in self.G: return None
         data = self.G.nodes[name].copy()
         etype = data.pop("type", "entity")
         return {"type": etype, "attrs": data}
 
+    def get_entities_info_bulk(self, names):
+        """get_entity_info for several entities as {name: info}; unknown names are omitted"""
+        infos = {}
+        for name in names:
+            info = self.get_entity_info(name)
+            if info:
+                infos[name] = info
+        return infos
+
+    def get_related_concepts_bulk(self, names, max_out: int = 10):
+        """get_related_concepts for several entities as {name: [(target, relation), ...]}"""
+        return {name: self.get_related_concepts(name, max_out) for name in names}
+
     def get_related_concepts(self, name: str, max_out: int = 10):
+        gen = self._entity_gen.get(name, 0)
+        cached = self._related_cache.get(name)
+        if cached is not None and cached[0] == gen and cached[1] == max_out:
+            return list(cached[2])
+        rels = self._compute_related_concepts(name, max_out)
+        self._related_cache[name] = (gen, max_out, rels)
+        return list(rels)
+
+    def _compute_related_concepts(self, name: str, max_out: int):
         if name not in self.G: return []
         rels = []
         # Outgoing edges: name -> target with relation
@@ -102,9 +165,11 @@ class KnowledgeGraph:
         
         for subj, obj, key in edges_to_remove:
             self.G.remove_edge(subj, obj, key)
+        self._touch(subject, *(obj for _, obj, _ in edges_to_remove))
         
         # Also remove from storage
         storage.remove_kg_relations(subject, predicate)
+        self.version += 1
 
     def update_relation(self, subject: str, predicate: str, new_object: str, weight: float = 1.0, **attrs):
         """Update a relation by replacing the object"""
@@ -2,7 +2,7 @@
 Improved MemoryEnhancer that properly integrates with KG and coordinates extraction
 """
 from typing import Dict, Any, List
-from memory_extractors import SemanticFactExtractor, SkillsExtractor
+from memory_extractors import SemanticFactExtractor, SkillsExtractor, extract_memories
 
 class ImprovedMemoryEnhancer:
     """Enhanced memory enhancer that coordinates all extraction and storage"""
@@ -30,12 +30,14 @@ class ImprovedMemoryEnhancer:
         }
         
         # Extract from user input
-        user_facts = self.semantic_extractor.extract_facts(user_input, "user")
-        user_skills = self.skills_extractor.extract_skills(user_input, "user")
+        user_facts, user_skills = extract_memories(
+            self.semantic_extractor, self.skills_extractor, user_input, "user"
+        )
         
         # Extract from agent response
-        agent_facts = self.semantic_extractor.extract_facts(agent_response, "assistant")
-        agent_skills = self.skills_extractor.extract_skills(agent_response, "assistant")
+        agent_facts, agent_skills = extract_memories(
+            self.semantic_extractor, self.skills_extractor, agent_response, "assistant"
+        )
         
         # Process facts with intelligent routing
         for fact in user_facts + agent_facts:
@@ -223,8 +225,8 @@ class ImprovedMemoryEnhancer:
     def get_memory_summary(self) -> Dict[str, Any]:
         """Get summary of extracted memories"""
         with self.storage.get_db() as conn:
-            semantic_count = conn.execute("SELECT COUNT(*) FROM semantic").fetchone()[0]
-            skills_count = conn.execute("SELECT COUNT(*) FROM skills").fetchone()[0]
+            counts = self.storage.count_rows(("semantic", "skills"))
+            semantic_count, skills_count = counts["semantic"], counts["skills"]
             
             recent_facts = conn.execute("""
                 SELECT key, value, source, ts FROM semantic 
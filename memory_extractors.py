@@ -6,9 +6,21 @@ Extracts structured facts and learning patterns from conversations
 
 import re
 import json
+import logging
+import os
+import atexit
+import hashlib
+import shelve
+import threading
 from typing import Dict, List, Any, Optional, Tuple
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Optional on-disk cache of extraction results, enabled by setting a path
+EXTRACTION_CACHE_PATH = os.getenv("COG_AI_EXTRACTION_CACHE")
+
 class SemanticFactExtractor:
     """Extracts semantic facts from conversations"""
     
@@ -244,6 +256,48 @@ class SkillsExtractor:
         
         return min(1.0, max(0.1, base_confidence))
 
+_extraction_store = None
+_extraction_lock = threading.Lock()
+
+def _get_extraction_store():
+    """Open the extraction cache shelf on first use (None when disabled)"""
+    global _extraction_store
+    if _extraction_store is None and EXTRACTION_CACHE_PATH:
+        try:
+            _extraction_store = shelve.open(EXTRACTION_CACHE_PATH)
+            atexit.register(_extraction_store.close)
+        except Exception:
+            logger.warning("Extraction cache unavailable", exc_info=True)
+    return _extraction_store
+
+def extract_memories(semantic_extractor, skills_extractor, text: str,
+                     speaker: str) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Extract (facts, skills) from text, reusing cached results across restarts.
+    
+    Only the pure extraction is cached; callers still store the results, so
+    cleared databases are repopulated. Skill timestamps are refreshed on a hit.
+    """
+    store = _get_extraction_store()
+    if store is None:
+        return (semantic_extractor.extract_facts(text, speaker),
+                skills_extractor.extract_skills(text, speaker))
+    
+    key = hashlib.blake2b(f"{speaker}|{text}".encode(), digest_size=16).hexdigest()
+    with _extraction_lock:
+        cached = store.get(key)
+    if cached is not None:
+        facts, skills = cached
+        now = datetime.now().isoformat()
+        for skill in skills:
+            skill["meta"]["timestamp"] = now
+        return facts, skills
+    
+    facts = semantic_extractor.extract_facts(text, speaker)
+    skills = skills_extractor.extract_skills(text, speaker)
+    with _extraction_lock:
+        store[key] = (facts, skills)
+    return facts, skills
+
 class MemoryEnhancer:
     """Main class that coordinates memory extraction and storage"""
     
@@ -264,12 +318,14 @@ class MemoryEnhancer:
         }
         
         # Extract from user input
-        user_facts = self.semantic_extractor.extract_facts(user_input, "user")
-        user_skills = self.skills_extractor.extract_skills(user_input, "user")
+        user_facts, user_skills = extract_memories(
+            self.semantic_extractor, self.skills_extractor, user_input, "user"
+        )
         
         # Extract from agent response
-        agent_facts = self.semantic_extractor.extract_facts(agent_response, "assistant")
-        agent_skills = self.skills_extractor.extract_skills(agent_response, "assistant")
+        agent_facts, agent_skills = extract_memories(
+            self.semantic_extractor, self.skills_extractor, agent_response, "assistant"
+        )
         
         # Store semantic facts in Knowledge Graph (unified storage)
         for fact in user_facts + agent_facts:
@@ -311,11 +367,9 @@ class MemoryEnhancer:
     def get_memory_summary(self) -> Dict[str, Any]:
         """Get summary of stored memories"""
         with self.storage.get_db() as conn:
-            # Count semantic facts
-            semantic_count = conn.execute("SELECT COUNT(*) FROM semantic").fetchone()[0]
-            
-            # Count skills
-            skills_count = conn.execute("SELECT COUNT(*) FROM skills").fetchone()[0]
+            # Count semantic facts and skills in one query
+            counts = self.storage.count_rows(("semantic", "skills"))
+            semantic_count, skills_count = counts["semantic"], counts["skills"]
             
             # Get recent facts
             recent_facts = conn.execute("""
@@ -1,9 +1,58 @@
 # memory_strategies.py
 from abc import ABC, abstractmethod
-from typing import Dict, Any, List, Tuple
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Tuple
+import json
+import logging
+import os
+import re
 import storage
 import embeddings
 
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Opt-in: the file holds users' raw queries in plain text, so nothing is read or
+# written unless COG_AI_WARM_QUERIES names a path
+WARM_QUERIES_PATH = os.getenv("COG_AI_WARM_QUERIES")
+
+# Query-type indicators as single substring alternations, checked in priority order
+_QUERY_TYPE_PATTERNS = tuple(
+    (qtype, re.compile("|".join(map(re.escape, indicators))))
+    for qtype, indicators in (
+        ("personal", ("my", "me", "i am", "i like", "my favorite")),
+        ("factual", ("what is", "how to", "explain", "define")),
+        ("conversational", ("hello", "hi", "how are you", "thanks", "bye")),
+    )
+)
+
+@lru_cache(maxsize=512)
+def _embed_query(query: str) -> List[float]:
+    """Embed a query, memoized so repeated and warmed queries skip the encoder"""
+    return embeddings.embed_text(query)
+
+def load_warm_queries(path: Optional[str] = WARM_QUERIES_PATH) -> List[str]:
+    """Load the list of common queries used to warm caches (empty if absent)"""
+    if not path or not os.path.exists(path):
+        return []
+    try:
+        with open(path) as f:
+            queries = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning("Could not load warm queries from %s: %s", path, e)
+        return []
+    return [q for q in queries if isinstance(q, str)]
+
+def _fetch_by_ids(kind: str, ids: List[int], context: Dict[str, Any]) -> List[Tuple]:
+    """Fetch memory rows, reusing rows already loaded during this request"""
+    cache = context.setdefault("_fetch_cache", {})
+    missing = [i for i in ids if (kind, i) not in cache]
+    if missing:
+        for rid, row in storage.get_rows_by_ids(kind, missing).items():
+            cache[(kind, rid)] = row
+    return [cache[(kind, i)] for i in ids if (kind, i) in cache]
+
 class MemoryStrategy(ABC):
     """Base class for memory retrieval strategies"""
     
@@ -28,12 +77,12 @@ class DefaultMemoryStrategy(MemoryStrategy):
         
         try:
             # Get query embedding
-            query_emb = embeddings.embed_text(query)
+            query_emb = _embed_query(query)
             
             # Retrieve from episodic memory
             episodic_ids = storage.nearest("episodic", query_emb, k=self.episodic_k)
             if episodic_ids:
-                episodic_items = storage.get_episodic_by_ids(episodic_ids)
+                episodic_items = _fetch_by_ids("episodic", episodic_ids, context)
                 for role, text, ts in episodic_items:
                     context_lines.append(f"Memory ({role}): {text[:100]}...")
             
@@ -50,14 +99,14 @@ class DefaultMemoryStrategy(MemoryStrategy):
                 # Fallback to semantic memory if no KG available
                 semantic_ids = storage.nearest("semantic", query_emb, k=self.semantic_k)
                 if semantic_ids:
-                    semantic_items = storage.get_semantic_by_ids(semantic_ids)
+                    semantic_items = _fetch_by_ids("semantic", semantic_ids, context)
                     for key, value, source, ts in semantic_items:
                         context_lines.append(f"Knowledge: {key} = {value}")
             
             # Retrieve from skills
             skill_ids = storage.nearest("skills", query_emb, k=self.skills_k)
             if skill_ids:
-                skill_items = storage.get_skills_by_ids(skill_ids)
+                skill_items = _fetch_by_ids("skills", skill_ids, context)
                 for note, meta, ts in skill_items:
                     context_lines.append(f"Learning: {note}")
             
@@ -72,8 +121,8 @@ class DefaultMemoryStrategy(MemoryStrategy):
                         for rel_entity, relation in related:
                             context_lines.append(f"  {entity} {relation} {rel_entity}")
                         
-        except Exception as e:
-            print(f"Context building error: {e}")
+        except Exception:
+            logger.exception("Context building error")
             context_lines.append("Recent conversation context available.")
         
         return context_lines
@@ -89,25 +138,14 @@ class AdaptiveMemoryStrategy(MemoryStrategy):
             "default": {"episodic_k": 3, "semantic_k": 2, "skills_k": 2, "kg_entities": 3}
         }
     
-    def _classify_query(self, query: str) -> str:
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def _classify_query(query: str) -> str:
         """Classify query type to determine memory strategy"""
         query_lower = query.lower()
-        
-        # Personal queries
-        personal_indicators = ["my", "me", "i am", "i like", "my favorite"]
-        if any(indicator in query_lower for indicator in personal_indicators):
-            return "personal"
-        
-        # Factual queries
-        factual_indicators = ["what is", "how to", "explain", "define"]
-        if any(indicator in query_lower for indicator in factual_indicators):
-            return "factual"
-        
-        # Conversational queries
-        conversational_indicators = ["hello", "hi", "how are you", "thanks", "bye"]
-        if any(indicator in query_lower for indicator in conversational_indicators):
-            return "conversational"
-        
+        for qtype, pattern in _QUERY_TYPE_PATTERNS:
+            if pattern.search(query_lower):
+                return qtype
         return "default"
     
     def retrieve_context(self, query: str, context: Dict[str, Any]) -> List[str]:
@@ -139,12 +177,13 @@ class RecentMemoryStrategy(MemoryStrategy):
             # Get recent episodic memories
             with storage.get_db() as conn:
                 recent_episodes = conn.execute(
-                    "SELECT role, text, ts FROM episodic ORDER BY ts DESC LIMIT ?",
+                    # Truncate in SQL so long turns are never copied out whole
+                    "SELECT role, substr(text, 1, 80), ts FROM episodic ORDER BY ts DESC LIMIT ?",
                     (self.max_items,)
                 ).fetchall()
             
             for role, text, ts in recent_episodes:
-                context_lines.append(f"Recent ({role}): {text[:80]}...")
+                context_lines.append(f"Recent ({role}): {text}...")
             
             # Add some KG context if available
             kg = context.get('kg')
@@ -155,8 +194,8 @@ class RecentMemoryStrategy(MemoryStrategy):
                     if info:
                         context_lines.append(f"Known: {entity} ({info['type']})")
         
-        except Exception as e:
-            print(f"Recent memory error: {e}")
+        except Exception:
+            logger.exception("Recent memory error")
         
         return context_lines
 
@@ -176,7 +215,7 @@ class PrioritizedMemoryStrategy(MemoryStrategy):
         context_lines = []
         
         try:
-            query_emb = embeddings.embed_text(query)
+            query_emb = _embed_query(query)
             
             # Calculate k values based on weights
             total_items = 10
@@ -189,8 +228,8 @@ class PrioritizedMemoryStrategy(MemoryStrategy):
             strategy = DefaultMemoryStrategy(episodic_k, semantic_k, skills_k, kg_k)
             context_lines = strategy.retrieve_context(query, context)
             
-        except Exception as e:
-            print(f"Prioritized memory error: {e}")
+        except Exception:
+            logger.exception("Prioritized memory error")
         
         return context_lines
 
@@ -210,7 +249,7 @@ class EnhancedMemoryStrategy(MemoryStrategy):
         context_lines = []
         
         try:
-            query_emb = embeddings.embed_text(query)
+            query_emb = _embed_query(query)
             
             # Calculate k values based on weights
             total_items = 12  # Increased for better coverage
@@ -223,7 +262,7 @@ class EnhancedMemoryStrategy(MemoryStrategy):
             if episodic_k > 0:
                 episodic_ids = storage.nearest("episodic", query_emb, k=episodic_k)
                 if episodic_ids:
-                    episodic_items = storage.get_episodic_by_ids(episodic_ids)
+                    episodic_items = _fetch_by_ids("episodic", episodic_ids, context)
                     for role, text, ts in episodic_items:
                         context_lines.append(f"Memory ({role}): {text[:80]}...")
             
@@ -243,7 +282,7 @@ class EnhancedMemoryStrategy(MemoryStrategy):
                     # Fallback to semantic memory if no KG available
                     semantic_ids = storage.nearest("semantic", query_emb, k=semantic_k)
                     if semantic_ids:
-                        semantic_items = storage.get_semantic_by_ids(semantic_ids)
+                        semantic_items = _fetch_by_ids("semantic", semantic_ids, context)
                         for key, value, source, ts in semantic_items:
                             # Format semantic facts more clearly
                             fact_type = self._extract_fact_type(key)
@@ -253,7 +292,7 @@ class EnhancedMemoryStrategy(MemoryStrategy):
             if skills_k > 0:
                 skill_ids = storage.nearest("skills", query_emb, k=skills_k)
                 if skill_ids:
-                    skill_items = storage.get_skills_by_ids(skill_ids)
+                    skill_items = _fetch_by_ids("skills", skill_ids, context)
                     for note, meta, ts in skill_items:
                         skill_type = meta.get("type", "general") if isinstance(meta, dict) else "general"
                         context_lines.append(f"Learning ({skill_type}): {note}")
@@ -270,8 +309,8 @@ class EnhancedMemoryStrategy(MemoryStrategy):
                             rel_text = ", ".join([f"{rel} {target}" for target, rel in related[:3]])
                             context_lines.append(f"Knowledge: {entity} ({info.get('type', 'entity')}) - {rel_text}")
             
-        except Exception as e:
-            print(f"Enhanced memory error: {e}")
+        except Exception:
+            logger.exception("Enhanced memory error")
         
         return context_lines
     
@@ -295,7 +334,9 @@ class EnhancedMemoryStrategy(MemoryStrategy):
 class MemoryManager:
     """Manages different memory strategies"""
     
-    def __init__(self):
+    def __init__(self, warm_queries_path: Optional[str] = WARM_QUERIES_PATH):
+        self.warm_queries_path = warm_queries_path
+        self.query_counts = Counter()
         self.strategies = {
             "default": DefaultMemoryStrategy(),
             "adaptive": AdaptiveMemoryStrategy(),
@@ -304,6 +345,29 @@ class MemoryManager:
             "enhanced": EnhancedMemoryStrategy()
         }
         self.current_strategy = "enhanced"  # Use enhanced by default
+        
+        # Pre-embed common queries so the first turns don't pay encoder cost
+        self._warm(load_warm_queries(warm_queries_path))
+    
+    def _warm(self, warm_queries: List[str]):
+        """Populate the query embedding cache with common queries"""
+        for query in warm_queries:
+            try:
+                _embed_query(query)
+            except Exception:
+                logger.exception("Cache warming error")
+                break
+    
+    def save_warm_queries(self, top_n: int = 20, path: str = None):
+        """Persist the most frequent queries seen so far for the next startup"""
+        path = path or self.warm_queries_path
+        if not path or not self.query_counts:
+            return
+        previous = load_warm_queries(path)
+        top = [q for q, _ in self.query_counts.most_common(top_n)]
+        merged = top + [q for q in previous if q not in top]
+        with open(path, "w") as f:
+            json.dump(merged[:top_n], f, indent=2)
     
     def set_strategy(self, strategy_name: str):
         """Set the active memory strategy"""
@@ -319,6 +383,7 @@ class MemoryManager:
     def get_context(self, query: str, context: Dict[str, Any]) -> str:
         """Get context using the current strategy"""
         strategy = self.strategies[self.current_strategy]
+        self.query_counts[query] += 1
         context_lines = strategy.retrieve_context(query, context)
         return "\n".join(context_lines) if context_lines else "No relevant context found."
     
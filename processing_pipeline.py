@@ -1,13 +1,47 @@
 # processing_pipeline.py
 from abc import ABC, abstractmethod
 from typing import Dict, Any, List, Optional, Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import nullcontext
 from dataclasses import dataclass
+from functools import partial
+import logging
+import os
+import queue
+import threading
 import time
-import json
+import weakref
 import re
-from memory_extractors import MemoryEnhancer
+import numpy as np
 
-@dataclass
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Similarity kernel for the semantic response cache; numba is optional
+try:
+    from numba import njit, prange
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _dot_scores(vecs, q):
+        sims = np.empty(vecs.shape[0], dtype=vecs.dtype)
+        for i in prange(vecs.shape[0]):
+            s = 0.0
+            for j in range(vecs.shape[1]):
+                s += vecs[i, j] * q[j]
+            sims[i] = s
+        return sims
+
+except Exception:
+    def _dot_scores(vecs, q):
+        return vecs @ q
+
+# Similarity above which ResponseGenerationStep reuses an earlier direct answer (0 disables)
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("COG_AI_RESPONSE_CACHE", "0") or 0)
+
+# Monotonic clock for step timestamps (integer ns, unaffected by wall-clock jumps)
+_now = time.monotonic_ns
+
+@dataclass(slots=True)
 class ProcessingContext:
     """Context object passed through the pipeline"""
     user_input: str
@@ -18,6 +52,7 @@ class ProcessingContext:
     response: str = ""
     extracted_knowledge: List[Dict[str, Any]] = None
     metadata: Dict[str, Any] = None
+    speculative_response: Optional[Future] = None  # direct answer started during planning
     
     def __post_init__(self):
         if self.raw_context is None:
@@ -27,9 +62,32 @@ class ProcessingContext:
         if self.metadata is None:
             self.metadata = {}
 
+# Memory enhancers shared by steps built over the same storage, embeddings and KG
+_SHARED_ENHANCERS = weakref.WeakValueDictionary()
+_SHARED_ENHANCERS_LOCK = threading.Lock()
+
+def get_shared_enhancer(enhancer_cls, storage_module, embeddings_module, kg=None):
+    """Return the enhancer for this (class, storage, embeddings, kg), creating it once.
+    
+    The enhancer holds references to its storage, embeddings and KG, so their ids
+    cannot be reused while the cached entry is alive.
+    """
+    key = (enhancer_cls, id(storage_module), id(embeddings_module), id(kg))
+    with _SHARED_ENHANCERS_LOCK:
+        enhancer = _SHARED_ENHANCERS.get(key)
+        if enhancer is None:
+            enhancer = enhancer_cls(storage_module, embeddings_module, kg)
+            _SHARED_ENHANCERS[key] = enhancer
+        return enhancer
+
 class ProcessingStep(ABC):
     """Base class for processing steps"""
     
+    __slots__ = ()
+    
+    # Steps that only consume the finished response can run after it is returned
+    post_response: bool = False
+    
     @property
     @abstractmethod
     def name(self) -> str:
@@ -43,10 +101,16 @@ class ProcessingStep(ABC):
     def can_skip(self, context: ProcessingContext) -> bool:
         """Check if this step can be skipped"""
         return False
+    
+    def flush(self):
+        """Wait for any writes this step has deferred"""
+        pass
 
 class ContextBuildingStep(ProcessingStep):
     """Step that builds context from memory"""
     
+    __slots__ = ("memory_manager",)
+    
     def __init__(self, memory_manager):
         self.memory_manager = memory_manager
     
@@ -62,62 +126,136 @@ class ContextBuildingStep(ProcessingStep):
                 context.user_input, raw_context
             )
             context.formatted_context = formatted_context
-            context.metadata["context_built_at"] = time.time()
-        except Exception as e:
-            print(f"Context building error: {e}")
+            context.metadata["context_built_at_ns"] = _now()
+        except Exception:
+            logger.exception("Context building error")
             context.formatted_context = "Basic context available."
         
         return context
 
+def _direct_response_prompt(context: ProcessingContext) -> str:
+    """Prompt for answering without a tool"""
+    return (
+        f"You are a helpful AI assistant. Use the context when relevant but don't mention it explicitly.\n"
+        f"CONTEXT:\n{context.formatted_context}\n\n"
+        f"USER: {context.user_input}\n\n"
+        f"Provide a helpful, concise response:"
+    )
+
+# Fast-path planning for inputs whose tool choice is obvious
+_CALC_RE = re.compile(r"^[\s\d+\-*/().^%]+$")
+_CALC_OPERATOR_RE = re.compile(r"\d\s*[+\-*/^%]\s*[\d(]")
+_GREETINGS = frozenset({
+    "hi", "hello", "hey", "hi there", "hello there", "good morning",
+    "good afternoon", "good evening", "thanks", "thank you", "bye", "goodbye"
+})
+_KNOWLEDGE_TOOLS = ("knowledge_graph", "intelligent_knowledge")
+# Questions about stored preferences; statements like "my favorite X is Y" must still reach the planner
+_PREFERENCE_QUESTION_RE = re.compile(
+    r"what is my favorite|what's my favorite|do i like|do you know what i like"
+    r"|what do i like|tell me about my preferences"
+)
+# Greedy prefix so the last ACTION line wins, as with the previous split-based parse
+_ACTION_RE = re.compile(r".*ACTION:\s*(\S+)", re.DOTALL)
+
+_PLAN_INSTRUCTIONS = """Choose the best tool or respond directly. 
+- Use "knowledge_graph" for questions about personal information, preferences, or stored knowledge
+- Use "calculator" for mathematical calculations
+- Use "web_search" for current information, recent events, real-time data, or when stored context is insufficient
+- Use "respond" for general conversation
+
+Output EXACTLY one line:
+ACTION: <tool_name>
+ACTION: respond"""
+
 class PlanningStep(ProcessingStep):
     """Step that plans what action to take"""
     
-    def __init__(self, llm_caller, tool_registry):
+    __slots__ = ("llm_caller", "tool_registry", "_prompt_prefix", "_speculation_pool")
+    
+    def __init__(self, llm_caller, tool_registry, speculate_response: bool = False):
         self.llm_caller = llm_caller
         self.tool_registry = tool_registry
+        self._prompt_prefix = None
+        # Optionally generate the direct answer while the planner decides
+        self._speculation_pool = (
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="speculative-response")
+            if speculate_response else None
+        )
     
     @property
     def name(self) -> str:
         return "planning"
     
+    def invalidate_tool_cache(self):
+        """Rebuild the tool descriptions on the next turn (call after tools change)"""
+        self._prompt_prefix = None
+    
+    def _get_prompt(self, context: ProcessingContext) -> str:
+        """Build the planning prompt around the cached tool descriptions"""
+        if self._prompt_prefix is None:
+            available_tools = self.tool_registry.get_tool_descriptions()
+            self._prompt_prefix = f"Available tools:\n{available_tools}\n\n"
+        return (f"{self._prompt_prefix}CONTEXT:\n{context.formatted_context}\n\n"
+                f"USER: {context.user_input}\n\n{_PLAN_INSTRUCTIONS}")
+    
+    def _fast_plan(self, user_input: str):
+        """Pick an action without the LLM when the input is unambiguous.
+        
+        Returns (matched, tool_name); tool_name is None for a direct response.
+        """
+        text = user_input.strip()
+        lowered = text.lower()
+        tools = self.tool_registry.tools
+        
+        if "calculator" in tools and _CALC_RE.match(text) and _CALC_OPERATOR_RE.search(text):
+            return True, "calculator"
+        
+        if lowered.rstrip("!.?").strip() in _GREETINGS:
+            return True, None
+        
+        if _PREFERENCE_QUESTION_RE.search(lowered):
+            for tool_name in _KNOWLEDGE_TOOLS:
+                if tool_name in tools:
+                    return True, tool_name
+        
+        return False, None
+    
     def process(self, context: ProcessingContext) -> ProcessingContext:
         """Plan the next action"""
+        matched, tool_name = self._fast_plan(context.user_input)
+        if matched:
+            context.selected_tool = tool_name
+            context.metadata["planned_via"] = "fastpath"
+            context.metadata["planned_at_ns"] = _now()
+            return context
+        
+        if self._speculation_pool is not None:
+            context.speculative_response = self._speculation_pool.submit(
+                self.llm_caller, _direct_response_prompt(context), mode="answer"
+            )
+        
         try:
-            available_tools = self.tool_registry.get_tool_descriptions()
-            prompt = f"""Available tools:
-{available_tools}
-
-CONTEXT:
-{context.formatted_context}
-
-USER: {context.user_input}
-
-Choose the best tool or respond directly. 
-- Use "knowledge_graph" for questions about personal information, preferences, or stored knowledge
-- Use "calculator" for mathematical calculations
-- Use "web_search" for current information, recent events, real-time data, or when stored context is insufficient
-- Use "respond" for general conversation
-
-Output EXACTLY one line:
-ACTION: <tool_name>
-ACTION: respond"""
+            prompt = self._get_prompt(context)
             
             plan_output = self.llm_caller(prompt, mode="plan")
             
             # Parse the action
-            if "ACTION:" in plan_output:
-                action = plan_output.split("ACTION:")[-1].strip()
-                if action in self.tool_registry.tools:
-                    context.selected_tool = action
-                else:
-                    context.selected_tool = None
+            match = _ACTION_RE.search(plan_output)
+            if match and match.group(1) in self.tool_registry.tools:
+                context.selected_tool = match.group(1)
             else:
                 context.selected_tool = None
             
-            context.metadata["planned_at"] = time.time()
+            # A tool will answer instead, so the speculative response is not needed
+            if context.selected_tool and context.speculative_response is not None:
+                context.speculative_response.cancel()
+                context.speculative_response = None
             
-        except Exception as e:
-            print(f"Planning error: {e}")
+            context.metadata["planned_at_ns"] = _now()
+            
+        except Exception:
+            logger.exception("Planning error")
             context.selected_tool = None
         
         return context
@@ -125,6 +263,8 @@ ACTION: respond"""
 class ToolExecutionStep(ProcessingStep):
     """Step that executes selected tools"""
     
+    __slots__ = ("tool_registry",)
+    
     def __init__(self, tool_registry):
         self.tool_registry = tool_registry
     
@@ -144,23 +284,132 @@ class ToolExecutionStep(ProcessingStep):
                 if tool:
                     result = tool.execute(context.user_input, context.raw_context)
                     context.tool_result = result
-                    context.metadata["tool_executed_at"] = time.time()
+                    context.metadata["tool_executed_at_ns"] = _now()
             except Exception as e:
-                print(f"Tool execution error: {e}")
+                logger.exception("Tool execution error")
                 context.tool_result = {"success": False, "error": str(e)}
         
         return context
 
+# Question analysis patterns for ResponseGenerationStep
+_PREFERENCE_PATTERNS = tuple(re.compile(p) for p in (
+    r"what is my favorite (.+)",
+    r"what's my favorite (.+)",
+    r"my favorite (.+) is",
+    r"do i like (.+)",
+    r"do you know what i like",
+    r"what do i like",
+    r"tell me about my preferences"
+))
+_GENERAL_KNOWLEDGE_RE = re.compile(r"what do you know|tell me about|what information")
+_SPECIFIC_ENTITY_RE = re.compile(r"(?:who|what|where|when) is")
+
+# Category vocabularies for filtering preferences
+_HOBBY_RE = re.compile("|".join(map(re.escape, (
+    'guitar', 'playing', 'music', 'reading', 'writing', 'drawing', 'painting',
+    'sports', 'hiking', 'running', 'swimming'
+))))
+# Substring matches, so stems cover plurals and compounds ('burger' in 'hamburgers')
+_FOOD_RE = re.compile("|".join(map(re.escape, (
+    'sushi', 'pizza', 'pasta', 'burger', 'chicken', 'beef', 'fish',
+    'vegetable', 'fruit', 'cake', 'cookie', 'ice cream'
+))))
+
+# (question triggers, vocabulary pattern, singular phrasing, plural phrasing)
+_PREFERENCE_CATEGORIES = (
+    (("hobby", "hobbies"), _HOBBY_RE, "your hobby is {}", "your hobbies include: {}"),
+    (("food", "eat"), _FOOD_RE, "your favorite food is {}", "your favorite foods include: {}"),
+)
+
+def _filter_by_category(preferences: List[str], pattern: re.Pattern) -> List[str]:
+    """Keep preferences containing any term from a category vocabulary"""
+    return [p for p in preferences if pattern.search(p.lower())]
+
+def _format_preferences(preferences: List[str], singular: str, plural: str) -> str:
+    """Phrase a list of preferences, using the singular form for a single item"""
+    if len(preferences) == 1:
+        return f"Based on what I know, {singular.format(preferences[0])}."
+    return f"Based on what I know, {plural.format(', '.join(preferences))}."
+
 class ResponseGenerationStep(ProcessingStep):
     """Step that generates the final response"""
     
-    def __init__(self, llm_caller):
+    __slots__ = ("llm_caller", "embeddings", "semantic_threshold", "semantic_cache_size",
+                 "_sem_cache_vecs", "_sem_cache_ctx", "_sem_cache_responses",
+                 "_sem_cache_next", "_sem_cache_count")
+    
+    def __init__(self, llm_caller, embeddings_module=None,
+                 semantic_threshold: Optional[float] = None, semantic_cache_size: int = 4096):
         self.llm_caller = llm_caller
+        # Semantic cache for direct responses: opt-in via COG_AI_RESPONSE_CACHE (a similarity
+        # threshold such as 0.95) and disabled without embeddings
+        self.embeddings = embeddings_module
+        if semantic_threshold is None:
+            semantic_threshold = RESPONSE_CACHE_THRESHOLD
+        self.semantic_threshold = semantic_threshold
+        self.semantic_cache_size = semantic_cache_size
+        # Ring buffer: unit query vectors, hashes of the context they were answered with,
+        # and responses; _sem_cache_next is the slot the next entry overwrites
+        self._sem_cache_vecs = None
+        self._sem_cache_ctx = np.zeros(semantic_cache_size, dtype=np.int64)
+        self._sem_cache_responses = [None] * semantic_cache_size
+        self._sem_cache_next = 0
+        self._sem_cache_count = 0
     
     @property
     def name(self) -> str:
         return "response_generation"
     
+    def _embed_for_cache(self, text: str) -> Optional[np.ndarray]:
+        """Embed text as a unit float32 vector for the semantic cache"""
+        if not self.embeddings or self.semantic_threshold <= 0:
+            return None
+        try:
+            q = np.asarray(self.embeddings.embed_text(text), dtype=np.float32)
+        except Exception:
+            logger.exception("Semantic cache embedding error")
+            return None
+        norm = np.linalg.norm(q)
+        return q / norm if norm > 0 else None
+    
+    def _align_cache_dims(self, q: np.ndarray) -> np.ndarray:
+        """Zero-pad cache or query so both share a dimension (BoW vocab only grows)"""
+        dim = self._sem_cache_vecs.shape[1]
+        if len(q) > dim:
+            self._sem_cache_vecs = np.pad(self._sem_cache_vecs, ((0, 0), (0, len(q) - dim)))
+        elif len(q) < dim:
+            q = np.pad(q, (0, dim - len(q)))
+        return q
+    
+    def _semantic_lookup(self, q: Optional[np.ndarray], ctx_key: int) -> Optional[str]:
+        """Return a cached response for a near-identical earlier query asked with the same context"""
+        count = self._sem_cache_count
+        if q is None or count == 0:
+            return None
+        q = self._align_cache_dims(q)
+        sims = _dot_scores(self._sem_cache_vecs[:count], q)
+        # Answers given with different memory/context must not be reused
+        sims[self._sem_cache_ctx[:count] != ctx_key] = -np.inf
+        best = int(np.argmax(sims))
+        if sims[best] > self.semantic_threshold:
+            return self._sem_cache_responses[best]
+        return None
+    
+    def _semantic_store(self, q: Optional[np.ndarray], ctx_key: int, response: str):
+        """Add a query/response pair, overwriting the oldest entry when full"""
+        if q is None or not response:
+            return
+        if self._sem_cache_vecs is None:
+            self._sem_cache_vecs = np.zeros((self.semantic_cache_size, len(q)), dtype=np.float32)
+        else:
+            q = self._align_cache_dims(q)
+        slot = self._sem_cache_next
+        self._sem_cache_vecs[slot] = q
+        self._sem_cache_ctx[slot] = ctx_key
+        self._sem_cache_responses[slot] = response
+        self._sem_cache_next = (slot + 1) % self.semantic_cache_size
+        self._sem_cache_count = min(self._sem_cache_count + 1, self.semantic_cache_size)
+    
     def process(self, context: ProcessingContext) -> ProcessingContext:
         """Generate the final response"""
         try:
@@ -184,18 +433,25 @@ class ResponseGenerationStep(ProcessingStep):
                     context.response = f"I encountered an error: {context.tool_result.get('error', 'Unknown error')}"
             else:
                 # Generate regular response
-                response_prompt = (
-                    f"You are a helpful AI assistant. Use the context when relevant but don't mention it explicitly.\n"
-                    f"CONTEXT:\n{context.formatted_context}\n\n"
-                    f"USER: {context.user_input}\n\n"
-                    f"Provide a helpful, concise response:"
-                )
-                context.response = self.llm_caller(response_prompt, mode="answer")
+                q = self._embed_for_cache(context.user_input)
+                ctx_key = hash(context.formatted_context)
+                cached = self._semantic_lookup(q, ctx_key)
+                if cached is not None:
+                    context.response = cached
+                    context.metadata["semantic_cache_hit"] = True
+                elif context.speculative_response is not None:
+                    # Planning already started this answer in parallel
+                    context.response = context.speculative_response.result()
+                    context.metadata["speculative_response_used"] = True
+                    self._semantic_store(q, ctx_key, context.response)
+                else:
+                    context.response = self.llm_caller(_direct_response_prompt(context), mode="answer")
+                    self._semantic_store(q, ctx_key, context.response)
             
-            context.metadata["response_generated_at"] = time.time()
+            context.metadata["response_generated_at_ns"] = _now()
             
-        except Exception as e:
-            print(f"Response generation error: {e}")
+        except Exception:
+            logger.exception("Response generation error")
             context.response = "I encountered an error generating a response. Please try again."
         
         return context
@@ -225,28 +481,18 @@ class ResponseGenerationStep(ProcessingStep):
     def _analyze_question(self, user_lower):
         """Analyze the user's question to determine type and subject"""
         # Personal preference questions
-        preference_patterns = [
-            r"what is my favorite (.+)",
-            r"what's my favorite (.+)",
-            r"my favorite (.+) is",
-            r"do i like (.+)",
-            r"do you know what i like",
-            r"what do i like",
-            r"tell me about my preferences"
-        ]
-        
-        for pattern in preference_patterns:
-            match = re.search(pattern, user_lower)
+        for pattern in _PREFERENCE_PATTERNS:
+            match = pattern.search(user_lower)
             if match:
                 subject = match.group(1).strip() if match.groups() else "preferences"
                 return "personal_preference", subject
         
         # General knowledge questions
-        if any(phrase in user_lower for phrase in ["what do you know", "tell me about", "what information"]):
+        if _GENERAL_KNOWLEDGE_RE.search(user_lower):
             return "general_knowledge", "everything"
         
         # Specific entity questions
-        if any(phrase in user_lower for phrase in ["who is", "what is", "where is", "when is"]):
+        if _SPECIFIC_ENTITY_RE.search(user_lower):
             # Extract the subject after the question word
             words = user_lower.split()
             if len(words) > 2:
@@ -257,32 +503,29 @@ class ResponseGenerationStep(ProcessingStep):
     
     def _handle_personal_preference_question(self, entities, subject, user_lower):
         """Handle questions about personal preferences"""
-        preferences = []
-        
-        # Look for user entity and their likes (outgoing relations)
-        user_entity = None
-        for entity in entities:
-            if entity.get("name") == "user":
-                user_entity = entity
-                break
-        
-        if user_entity:
-            relations = user_entity.get("relations", [])
-            for rel in relations:
-                if rel.get("relation") == "likes":
-                    target = rel.get("target", "")
-                    if target and target != "user":  # Avoid self-references
-                        preferences.append(target)
-        
-        # Also look for entities that like the user (incoming relations)
+        # Single pass: the user's likes (outgoing) and entities liked by the user (incoming)
+        user_likes = None
+        liked_by_user = []
         for entity in entities:
-            if entity.get("name") != "user":
-                relations = entity.get("relations", [])
-                for rel in relations:
-                    if rel.get("relation") in ["liked_by", "likes"] and rel.get("target") == "user":
-                        entity_name = entity.get("name", "")
-                        if entity_name and entity_name not in preferences:
-                            preferences.append(entity_name)
+            name = entity.get("name", "")
+            relations = entity.get("relations", [])
+            if name == "user":
+                if user_likes is None:
+                    user_likes = [
+                        rel.get("target", "") for rel in relations
+                        if rel.get("relation") == "likes"
+                    ]
+            elif name and any(rel.get("relation") in ("liked_by", "likes") and rel.get("target") == "user"
+                              for rel in relations):
+                liked_by_user.append(name)
+        
+        # User's own likes come first, avoiding self-references
+        preferences = [t for t in user_likes or () if t and t != "user"]
+        seen = set(preferences)
+        for name in liked_by_user:
+            if name not in seen:
+                seen.add(name)
+                preferences.append(name)
         
         if not preferences:
             return "I don't have information about your preferences."
@@ -290,51 +533,25 @@ class ResponseGenerationStep(ProcessingStep):
         # Format response based on subject
         if "favorite" in user_lower and subject != "preferences":
             # Look for specific type of preference
+            subject_lower = subject.lower()
             for pref in preferences:
-                if subject.lower() in pref.lower() or pref.lower() in subject.lower():
+                pref_lower = pref.lower()
+                if subject_lower in pref_lower or pref_lower in subject_lower:
                     return f"Your favorite {subject} is {pref}!"
             
             # If no specific match, return what we have
-            if len(preferences) == 1:
-                return f"Based on what I know, you like {preferences[0]}."
-            else:
-                return f"Based on what I know, you like: {', '.join(preferences)}."
-        elif "hobby" in user_lower or "hobbies" in user_lower:
-            # Filter for hobby-related preferences
-            hobby_prefs = [p for p in preferences if any(word in p.lower() for word in ['guitar', 'playing', 'music', 'reading', 'writing', 'drawing', 'painting', 'sports', 'hiking', 'running', 'swimming'])]
-            if hobby_prefs:
-                if len(hobby_prefs) == 1:
-                    return f"Based on what I know, your hobby is {hobby_prefs[0]}."
-                else:
-                    return f"Based on what I know, your hobbies include: {', '.join(hobby_prefs)}."
-            else:
-                return f"Based on what I know, you like: {', '.join(preferences)}."
-        elif "hobby" in subject.lower() or "hobbies" in subject.lower():
-            # Filter for hobby-related preferences when subject mentions hobbies
-            hobby_prefs = [p for p in preferences if any(word in p.lower() for word in ['guitar', 'playing', 'music', 'reading', 'writing', 'drawing', 'painting', 'sports', 'hiking', 'running', 'swimming'])]
-            if hobby_prefs:
-                if len(hobby_prefs) == 1:
-                    return f"Based on what I know, your hobby is {hobby_prefs[0]}."
-                else:
-                    return f"Based on what I know, your hobbies include: {', '.join(hobby_prefs)}."
-            else:
-                return f"Based on what I know, you like: {', '.join(preferences)}."
-        elif "food" in user_lower or "eat" in user_lower:
-            # Filter for food-related preferences
-            food_prefs = [p for p in preferences if any(word in p.lower() for word in ['sushi', 'pizza', 'pasta', 'burger', 'chicken', 'beef', 'fish', 'vegetable', 'fruit', 'cake', 'cookie', 'ice cream'])]
-            if food_prefs:
-                if len(food_prefs) == 1:
-                    return f"Based on what I know, your favorite food is {food_prefs[0]}."
-                else:
-                    return f"Based on what I know, your favorite foods include: {', '.join(food_prefs)}."
-            else:
-                return f"Based on what I know, you like: {', '.join(preferences)}."
-        else:
-            # General preferences question
-            if len(preferences) == 1:
-                return f"Based on what I know, you like {preferences[0]}."
-            else:
+            return _format_preferences(preferences, "you like {}", "you like: {}")
+        
+        # Category questions (hobbies, food) filter preferences by vocabulary
+        for triggers, pattern, singular, plural in _PREFERENCE_CATEGORIES:
+            if any(trigger in user_lower for trigger in triggers):
+                matches = _filter_by_category(preferences, pattern)
+                if matches:
+                    return _format_preferences(matches, singular, plural)
                 return f"Based on what I know, you like: {', '.join(preferences)}."
+        
+        # General preferences question
+        return _format_preferences(preferences, "you like {}", "you like: {}")
     
     def _handle_general_knowledge_question(self, entities, subject, user_lower):
         """Handle general knowledge questions"""
@@ -436,13 +653,17 @@ Response:"""
                     response += f"\n\n(Source: {primary_source})"
             
             return response
-        except Exception as e:
-            print(f"Error generating web search response: {e}")
+        except Exception:
+            logger.exception("Error generating web search response")
             return f"Based on my search for '{query}': {summary}"
 
 class KnowledgeExtractionStep(ProcessingStep):
     """Step that extracts knowledge from user input"""
     
+    __slots__ = ("knowledge_extractor",)
+    
+    post_response = True
+    
     def __init__(self, knowledge_extractor):
         self.knowledge_extractor = knowledge_extractor
     
@@ -461,37 +682,104 @@ class KnowledgeExtractionStep(ProcessingStep):
                 context.user_input, context.raw_context
             )
             context.extracted_knowledge = knowledge_items
-            context.metadata["knowledge_extracted_at"] = time.time()
-        except Exception as e:
-            print(f"Knowledge extraction error: {e}")
+            context.metadata["knowledge_extracted_at_ns"] = _now()
+        except Exception:
+            logger.exception("Knowledge extraction error")
             context.extracted_knowledge = []
         
         return context
 
+# Queue sentinel telling MemoryStorageStep's writer thread to exit
+_STOP_WRITER = object()
+
 class MemoryStorageStep(ProcessingStep):
     """Enhanced step that stores conversation and knowledge in memory"""
     
-    def __init__(self, storage_module, embeddings_module, kg=None):
+    __slots__ = ("storage", "embeddings", "kg", "memory_enhancer", "batch_size",
+                 "flush_interval", "_write_q", "_writer")
+    
+    post_response = True
+    
+    def __init__(self, storage_module, embeddings_module, kg=None,
+                 batch_size: int = 32, flush_interval: float = 0.05):
         self.storage = storage_module
         self.embeddings = embeddings_module
         self.kg = kg
-        self.memory_enhancer = MemoryEnhancer(storage_module, embeddings_module, kg)
+        from memory_extractors import MemoryEnhancer  # only memory pipelines need it
+        self.memory_enhancer = get_shared_enhancer(MemoryEnhancer, storage_module, embeddings_module, kg)
+        
+        # Episodic writes are batched by a background writer, started on the first write
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._write_q = queue.Queue()
+        self._writer = None
     
     @property
     def name(self) -> str:
         return "memory_storage"
     
+    def _enqueue(self, role: str, text: str):
+        """Queue an episodic write, starting the writer thread if needed"""
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._flush_loop, name="memory-writer", daemon=True)
+            self._writer.start()
+        self._write_q.put((role, text))
+    
+    def _flush_loop(self):
+        """Drain queued episodic writes in batches of up to batch_size or flush_interval"""
+        stopping = False
+        while not stopping:
+            batch = []
+            item = self._write_q.get()
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is _STOP_WRITER:
+                    stopping = True
+                    self._write_q.task_done()
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._write_q.get(timeout=timeout)
+                except queue.Empty:
+                    break
+            if not batch:
+                continue
+            try:
+                self._write_episodic_batch(batch)
+            except Exception:
+                logger.exception("Memory writer error")
+            finally:
+                for _ in batch:
+                    self._write_q.task_done()
+    
+    def _write_episodic_batch(self, batch):
+        """Embed and store a batch of (role, text) episodic entries"""
+        embs = self.embeddings.embed_texts([text for _, text in batch])
+        ids = self.storage.insert_episodic_many(batch)
+        self.storage.upsert_vectors_many("episodic", list(zip(ids, embs)))
+    
+    def flush(self):
+        """Wait until all queued episodic writes are stored"""
+        self._write_q.join()
+    
+    def close(self):
+        """Store queued writes and stop the writer thread; a later write restarts it"""
+        writer, self._writer = self._writer, None
+        if writer is not None:
+            self._write_q.put(_STOP_WRITER)
+            writer.join()
+    
     def process(self, context: ProcessingContext) -> ProcessingContext:
         """Store conversation and extracted knowledge with enhanced memory extraction"""
         try:
-            # Store episodic memory
-            user_id = self.storage.insert_episodic("user", context.user_input)
-            user_emb = self.embeddings.embed_text(context.user_input)
-            self.storage.upsert_vector("episodic", user_id, user_emb)
-            
-            agent_id = self.storage.insert_episodic("assistant", context.response)
-            agent_emb = self.embeddings.embed_text(context.response)
-            self.storage.upsert_vector("episodic", agent_id, agent_emb)
+            # Store episodic memory (embedded and written by the background writer)
+            self._enqueue("user", context.user_input)
+            self._enqueue("assistant", context.response)
             
             # Enhanced memory extraction for semantic facts and skills
             memory_results = self.memory_enhancer.process_conversation(
@@ -510,38 +798,46 @@ class MemoryStorageStep(ProcessingStep):
             # Update knowledge graph
             kg = context.raw_context.get("kg")
             if kg and context.extracted_knowledge:
+                # Collect each entity once (last type wins) before touching relations
+                entity_types = {}
+                pending_relations = []
                 for item in context.extracted_knowledge:
                     entity = item.get("entity", "")
-                    etype = item.get("type", "entity")
                     relation = item.get("relation", "related_to")
                     target = item.get("target", "user")
-                    replaces = item.get("replaces", False)
                     
                     if entity and relation:
-                        kg.upsert_entity(entity, etype)
-                        kg.upsert_entity(target, "person")
-                        
-                        if replaces:
-                            kg.update_relation(target, relation, entity)
-                        else:
-                            kg.upsert_relation(target, relation, entity)
+                        entity_types[entity] = item.get("type", "entity")
+                        entity_types[target] = "person"
+                        pending_relations.append((target, relation, entity, item.get("replaces", False)))
+                
+                kg.upsert_entities_many((name, etype, {}) for name, etype in entity_types.items())
+                for target, relation, entity, replaces in pending_relations:
+                    if replaces:
+                        kg.update_relation(target, relation, entity)
+                    else:
+                        kg.upsert_relation(target, relation, entity)
             
             # Store memory extraction results in metadata
             context.metadata["memory_extraction_results"] = memory_results
-            context.metadata["memory_stored_at"] = time.time()
+            context.metadata["memory_stored_at_ns"] = _now()
             
             # Log memory extraction results
             if memory_results["stored_facts"] > 0 or memory_results["stored_skills"] > 0:
                 print(f"Memory extracted: {memory_results['stored_facts']} facts, {memory_results['stored_skills']} skills")
             
-        except Exception as e:
-            print(f"Memory storage error: {e}")
+        except Exception:
+            logger.exception("Memory storage error")
         
         return context
 
 class ReflectionStep(ProcessingStep):
     """Step that performs periodic reflection"""
     
+    __slots__ = ("storage", "embeddings", "reflection_interval", "turn_counter")
+    
+    post_response = True
+    
     def __init__(self, storage_module, embeddings_module, reflection_interval=5):
         self.storage = storage_module
         self.embeddings = embeddings_module
@@ -568,18 +864,27 @@ class ReflectionStep(ProcessingStep):
                 skill_emb = self.embeddings.embed_text(summary)
                 self.storage.upsert_vector("skills", skill_id, skill_emb)
                 
-                context.metadata["reflected_at"] = time.time()
-        except Exception as e:
-            print(f"Reflection error: {e}")
+                context.metadata["reflected_at_ns"] = _now()
+        except Exception:
+            logger.exception("Reflection error")
         
         return context
 
 class ProcessingPipeline:
     """Configurable processing pipeline"""
     
-    def __init__(self):
+    def __init__(self, transaction: Optional[Callable] = None):
         self.steps: List[ProcessingStep] = []
         self.middleware: List[Callable] = []
+        # Context manager factory grouping each run of steps into one storage commit
+        self.transaction = transaction or nullcontext
+        # The tail runs on a worker thread while the next turn may write, so it takes
+        # the write lock when it begins rather than upgrading a read snapshot later
+        self._tail_transaction = partial(transaction, immediate=True) if transaction else nullcontext
+        # Single worker so each turn's post-response steps run in order
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pipeline-tail")
+        self._pending_tail = None
+        self._plan = None
     
     def add_step(self, step: ProcessingStep, position: Optional[int] = None):
         """Add a processing step"""
@@ -587,37 +892,90 @@ class ProcessingPipeline:
             self.steps.append(step)
         else:
             self.steps.insert(position, step)
+        self._plan = None
     
     def remove_step(self, step_name: str):
         """Remove a processing step"""
         self.steps = [step for step in self.steps if step.name != step_name]
+        self._plan = None
     
     def add_middleware(self, middleware_func: Callable):
         """Add middleware function that runs before each step"""
         self.middleware.append(middleware_func)
     
-    def process(self, user_input: str, raw_context: Dict[str, Any] = None) -> str:
-        """Process user input through the pipeline"""
-        context = ProcessingContext(user_input=user_input, raw_context=raw_context or {})
-        
-        for step in self.steps:
+    def _split_steps(self):
+        """Split steps into those needed for the response and the post-response tail"""
+        for i, step in enumerate(self.steps):
+            if step.post_response:
+                return self.steps[:i], self.steps[i:]
+        return self.steps, []
+    
+    def _compiled_steps(self):
+        """(head, tail) dispatch tuples of (step, can_skip or None, process), built once per step list"""
+        if self._plan is None:
+            def compile_steps(steps):
+                return tuple(
+                    (step,
+                     None if type(step).can_skip is ProcessingStep.can_skip else step.can_skip,
+                     step.process)
+                    for step in steps
+                )
+            head, tail = self._split_steps()
+            self._plan = (compile_steps(head), compile_steps(tail))
+        return self._plan
+    
+    def _run_steps(self, context: ProcessingContext, steps, transaction=None) -> ProcessingContext:
+        """Run compiled steps in order, isolating failures to the step that raised"""
+        with (transaction or self.transaction)():
+            return self._run_steps_unbatched(context, steps)
+    
+    def _run_steps_unbatched(self, context: ProcessingContext, steps) -> ProcessingContext:
+        middleware_funcs = self.middleware
+        for step, can_skip, process in steps:
             try:
                 # Run middleware
-                for middleware in self.middleware:
+                for middleware in middleware_funcs:
                     middleware(context, step)
                 
                 # Skip step if conditions are met
-                if step.can_skip(context):
+                if can_skip is not None and can_skip(context):
                     continue
                 
                 # Process the step
-                context = step.process(context)
+                context = process(context)
                 
-            except Exception as e:
-                print(f"Error in step {step.name}: {e}")
+            except Exception:
+                logger.exception("Error in step %s", step.name)
                 continue
         
+        return context
+    
+    def process(self, user_input: str, raw_context: Dict[str, Any] = None) -> str:
+        """Process user input through the pipeline"""
+        # The previous turn's memory writes must be visible to context building
+        self.flush()
+        
+        context = ProcessingContext(user_input=user_input, raw_context=raw_context or {})
+        head, tail = self._compiled_steps()
+        context = self._run_steps(context, head)
+        
+        if tail:
+            self._pending_tail = self._executor.submit(self._run_steps, context, tail, self._tail_transaction)
+        
         return context.response
+    
+    def flush(self):
+        """Wait for post-response steps from the last turn to finish"""
+        pending, self._pending_tail = self._pending_tail, None
+        if pending is not None:
+            # Steps already log their own errors; what reaches here is the tail's own
+            # transaction failing (e.g. a busy timeout), which must not fail the next turn
+            try:
+                pending.result()
+            except Exception:
+                logger.exception("post-response tail failed")
+        for step in self.steps:
+            step.flush()
 
 # Example pipeline factory
 class PipelineFactory:
@@ -625,17 +983,18 @@ class PipelineFactory:
     
     @staticmethod
     def create_default_pipeline(llm_caller, tool_registry, memory_manager, 
-                               knowledge_extractor, storage_module, embeddings_module, kg=None):
+                               knowledge_extractor, storage_module, embeddings_module, kg=None,
+                               speculate_response: bool = False):
         """Create the default processing pipeline"""
         from complete_enhanced_memory import CompleteEnhancedMemoryStorageStep
         
-        pipeline = ProcessingPipeline()
+        pipeline = ProcessingPipeline(getattr(storage_module, "transaction", None))
         
         # Add steps in order
         pipeline.add_step(ContextBuildingStep(memory_manager))
-        pipeline.add_step(PlanningStep(llm_caller, tool_registry))
+        pipeline.add_step(PlanningStep(llm_caller, tool_registry, speculate_response))
         pipeline.add_step(ToolExecutionStep(tool_registry))
-        pipeline.add_step(ResponseGenerationStep(llm_caller))
+        pipeline.add_step(ResponseGenerationStep(llm_caller, embeddings_module))
         pipeline.add_step(KnowledgeExtractionStep(knowledge_extractor))
         pipeline.add_step(CompleteEnhancedMemoryStorageStep(storage_module, embeddings_module, kg, llm_caller))
         pipeline.add_step(ReflectionStep(storage_module, embeddings_module))
@@ -659,10 +1018,10 @@ class PipelineFactory:
         """Create a pipeline focused on memory without tools"""
         from complete_enhanced_memory import CompleteEnhancedMemoryStorageStep
         
-        pipeline = ProcessingPipeline()
+        pipeline = ProcessingPipeline(getattr(storage_module, "transaction", None))
         
         pipeline.add_step(ContextBuildingStep(memory_manager))
-        pipeline.add_step(ResponseGenerationStep(llm_caller))
+        pipeline.add_step(ResponseGenerationStep(llm_caller, embeddings_module))
         pipeline.add_step(CompleteEnhancedMemoryStorageStep(storage_module, embeddings_module, kg, llm_caller))
         pipeline.add_step(ReflectionStep(storage_module, embeddings_module))
         
@@ -1,11 +1,17 @@
 # refactored_cognitive_agent.py
 import re
 import json
+import logging
+import logging.handlers
 import time
 import math
+import os
+import threading
 from collections import deque
+from functools import lru_cache
 from typing import List, Dict, Any, Optional
 import ollama
+import numpy as np
 from dotenv import load_dotenv
 
 # Import the modular components
@@ -22,6 +28,9 @@ from processing_pipeline import ProcessingPipeline, PipelineFactory
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
 def get_ollama_client():
     """Test if Ollama is available"""
     try:
@@ -30,40 +39,131 @@ def get_ollama_client():
     except Exception:
         return False
 
-def call_ollama_model(prompt: str, mode: str = "answer", model: str = "llama3.1") -> str:
-    """Call Ollama with mode support"""
+# Static system prefixes: Ollama reuses its KV cache only for identical prompt prefixes,
+# so nothing per-call (timestamps, turn numbers) may be interpolated here
+PLAN_SYSTEM = (
+    "You are a planning assistant. You must respond with EXACTLY ONE LINE:\n"
+    "ACTION: <tool_name>\n"
+    "ACTION: respond\n"
+    "Choose the appropriate tool based on available tools, or respond for general conversation."
+)
+_SYSTEM_PROMPTS = {"plan": PLAN_SYSTEM}
+OLLAMA_KEEP_ALIVE = os.getenv("COG_AI_KEEP_ALIVE", "60m")
+
+def _chat(model: str, mode: str, prompt: str) -> str:
+    """Send one prompt to Ollama; raises on failure"""
+    messages = [{'role': 'user', 'content': prompt}]
+    system = _SYSTEM_PROMPTS.get(mode)
+    if system:
+        messages.insert(0, {'role': 'system', 'content': system})
+    response = ollama.chat(model=model, messages=messages, keep_alive=OLLAMA_KEEP_ALIVE)
+    return response['message']['content'].strip()
+
+# Exceptions are never cached, so fallback responses are not memoized
+_cached_chat = lru_cache(maxsize=1024)(_chat)
+
+class SemanticLLMCache:
+    """Serve responses for prompts whose embedding is close to an earlier prompt's"""
+    
+    def __init__(self, threshold: float = 0.92, max_entries: int = 4096):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = None  # (model, mode) -> [unit vectors matrix, responses]
+    
+    def _embed(self, texts: List[str]) -> List[np.ndarray]:
+        vecs = [np.asarray(v, dtype=np.float32) for v in embeddings.embed_texts(texts)]
+        return [v / (np.linalg.norm(v) or 1.0) for v in vecs]
+    
+    def _add(self, key, q: np.ndarray, response: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            self._entries[key] = [q[np.newaxis, :], [response]]
+            return
+        vecs, responses = entry
+        if len(q) > vecs.shape[1]:
+            vecs = np.pad(vecs, ((0, 0), (0, len(q) - vecs.shape[1])))
+        elif len(q) < vecs.shape[1]:
+            q = np.pad(q, (0, vecs.shape[1] - len(q)))
+        entry[0] = np.vstack([vecs, q])[-self.max_entries:]
+        responses.append(response)
+        del responses[:-self.max_entries]
+    
+    def _load(self):
+        """Re-embed persisted prompts; vectors are not stored since the BoW vocab is per-process"""
+        self._entries = {}
+        try:
+            rows = storage.load_llm_cache(self.max_entries)
+        except Exception:
+            return
+        if rows:
+            for (model, mode, _, response), q in zip(rows, self._embed([r[2] for r in rows])):
+                self._add((model, mode), q, response)
+    
+    def lookup(self, model: str, mode: str, prompt: str):
+        """Return (cached response or None, prompt embedding)"""
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            q = self._embed([prompt])[0]
+            entry = self._entries.get((model, mode))
+            if entry is None:
+                return None, q
+            vecs, responses = entry
+            dim = vecs.shape[1]
+            sims = vecs @ (q[:dim] if len(q) >= dim else np.pad(q, (0, dim - len(q))))
+            best = int(np.argmax(sims))
+            return (responses[best] if sims[best] >= self.threshold else None), q
+    
+    def store(self, model: str, mode: str, prompt: str, response: str, q: np.ndarray):
+        with self._lock:
+            self._add((model, mode), q, response)
+        try:
+            storage.insert_llm_cache(model, mode, prompt, response)
+        except Exception:
+            logger.warning("LLM cache persist error", exc_info=True)
+
+# Opt-in: set COG_AI_SEMANTIC_CACHE to a cosine threshold (e.g. 0.92) to enable
+_semantic_threshold = float(os.getenv("COG_AI_SEMANTIC_CACHE", "0") or 0)
+_semantic_cache = SemanticLLMCache(_semantic_threshold) if _semantic_threshold > 0 else None
+
+def call_ollama_model(prompt: str, mode: str = "answer", model: str = "llama3.1",
+                      ollama_cache_bypass: bool = False) -> str:
+    """Call Ollama with mode support; identical prompts are served from an LRU cache"""
     if not get_ollama_client():
         return fallback_model(prompt, mode)
     
+    semantic = _semantic_cache if not ollama_cache_bypass else None
+    q = None
+    if semantic:
+        cached, q = semantic.lookup(model, mode, prompt)
+        if cached is not None:
+            return cached
+    
     try:
-        # Add mode-specific instructions to prompt
-        if mode == "plan":
-            system_msg = (
-                "You are a planning assistant. You must respond with EXACTLY ONE LINE:\n"
-                "ACTION: <tool_name>\n"
-                "ACTION: respond\n"
-                "Choose the appropriate tool based on available tools, or respond for general conversation."
-            )
-            full_prompt = f"{system_msg}\n\n{prompt}"
-        else:
-            full_prompt = prompt
-            
-        response = ollama.chat(model=model, messages=[
-            {'role': 'user', 'content': full_prompt}
-        ])
-        return response['message']['content'].strip()
+        chat = _chat if ollama_cache_bypass else _cached_chat
+        response = chat(model, mode, prompt)
     except Exception as e:
         print(f"Ollama error: {e}")
         return fallback_model(prompt, mode)
+    if semantic:
+        semantic.store(model, mode, prompt, response, q)
+    return response
+
+_FALLBACK_MATH_RE = re.compile(r'\d+[\+\-\*/\^\(\)]\d+|\d+\s*[\+\-\*/\^]\s*\d+')
+_FALLBACK_KNOWLEDGE_RE = re.compile(r"what do you know|my favorite")
+# Substring alternation keeps the old `word in prompt` semantics ("searching", "weather?")
+_FALLBACK_SEARCH_RE = re.compile(r"search|latest|current|news|price|weather")
 
 def fallback_model(prompt: str, mode: str) -> str:
     """Fallback when Ollama unavailable"""
     if mode == "plan":
-        if re.search(r'\d+[\+\-\*/\^\(\)]\d+|\d+\s*[\+\-\*/\^]\s*\d+', prompt):
+        low = prompt.lower()
+        if _FALLBACK_MATH_RE.search(prompt):
             return "ACTION: calculator"
-        elif "what do you know" in prompt.lower() or "my favorite" in prompt.lower():
+        elif _FALLBACK_KNOWLEDGE_RE.search(low):
             return "ACTION: knowledge_graph"
-        elif any(word in prompt.lower() for word in ["search", "latest", "current", "news", "price", "weather"]):
+        elif _FALLBACK_SEARCH_RE.search(low):
             return "ACTION: web_search"  # Add this line
         else:
             return "ACTION: respond"
@@ -153,7 +253,8 @@ class CognitiveAgent:
         if pipeline_type == "default":
             self.pipeline = PipelineFactory.create_default_pipeline(
                 call_ollama_model, self.tool_registry, self.memory_manager,
-                self.knowledge_extractor, storage, embeddings, self.kg
+                self.knowledge_extractor, storage, embeddings, self.kg,
+                speculate_response=self.config.get("speculative_response", False)
             )
         elif pipeline_type == "simple":
             self.pipeline = PipelineFactory.create_simple_pipeline(
@@ -201,7 +302,8 @@ class CognitiveAgent:
             # Prepare context for pipeline
             raw_context = {"kg": self.kg}
             
-            # Process through pipeline
+            # The pipeline commits its response steps before handing the rest to its
+            # background tail, so no transaction is held open here
             response = self.pipeline.process(user_msg, raw_context)
             
             self.turn += 1
@@ -211,14 +313,26 @@ class CognitiveAgent:
             print(f"Agent error: {e}")
             return "I encountered an error processing your request. Please try again."
     
+    def flush(self):
+        """Wait until background memory updates from the last turn are stored"""
+        self.pipeline.flush()
+    
     # Configuration methods
     def add_tool(self, tool, priority: int = 0):
         """Add a new tool to the agent"""
         self.tool_registry.register(tool, priority)
+        self._invalidate_tool_caches()
     
     def remove_tool(self, tool_name: str):
         """Remove a tool from the agent"""
         self.tool_registry.unregister(tool_name)
+        self._invalidate_tool_caches()
+    
+    def _invalidate_tool_caches(self):
+        """Let pipeline steps pick up the changed tool set"""
+        for step in self.pipeline.steps:
+            if hasattr(step, "invalidate_tool_cache"):
+                step.invalidate_tool_cache()
     
     def set_memory_strategy(self, strategy_name: str):
         """Change the memory strategy"""
@@ -230,6 +344,7 @@ class CognitiveAgent:
     
     def get_status(self) -> Dict[str, Any]:
         """Get agent status information"""
+        self.flush()
         return {
             "turn": self.turn,
             "tools": self.tool_registry.list_tools(),
@@ -294,8 +409,30 @@ class AgentConfigurations:
             ]
         }
 
+_QUIT_COMMANDS = frozenset(("quit", "exit", "bye"))
+
+def _configure_logging():
+    """Send module loggers' warnings and tracebacks to stderr, or to a rotating file if COG_AI_LOG_FILE is set"""
+    log_file = os.getenv("COG_AI_LOG_FILE")
+    handlers = None
+    if log_file:
+        handlers = [logging.handlers.RotatingFileHandler(log_file, maxBytes=1 << 20, backupCount=3)]
+    logging.basicConfig(
+        level=os.getenv("COG_AI_LOG_LEVEL", "WARNING").upper(),
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+        handlers=handlers,
+    )
+
 def main():
     """Main demo function with configuration options"""
+    _configure_logging()
+    
+    # Line editing and history for input() where the platform provides it
+    try:
+        import readline  # noqa: F401
+    except ImportError:
+        pass
+    
     print("🧠 Refactored Cognitive Agent Starting...")
     
     # Check Ollama
@@ -339,9 +476,10 @@ def main():
         while True:
             try:
                 user_input = input("You: ").strip()
-                if user_input.lower() in ['quit', 'exit', 'bye']:
+                command = user_input.lower()
+                if command in _QUIT_COMMANDS:
                     break
-                elif user_input.lower() == 'status':
+                elif command == 'status':
                     status = agent.get_status()
                     print(f"Agent Status: {json.dumps(status, indent=2)}")
                     continue
@@ -353,7 +491,10 @@ def main():
                 break
             except Exception as e:
                 print(f"Error: {e}")
-    
+
+        # Remember this session's common queries for cache warming next time
+        agent.memory_manager.save_warm_queries()
+
     except Exception as e:
         print(f"Startup error: {e}")
     
@@ -1,10 +1,148 @@
 # storage.py
-import sqlite3, time, json, os, pickle
+import sqlite3, time, json, os, pickle, threading, atexit, logging
+from contextlib import contextmanager
+
+import numpy as np
 
 DB_PATH = os.getenv("COG_AI_DB", "cogai.db")
 
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# orjson decodes attribute blobs several times faster when available
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    _json_loads = json.loads
+
+_EMPTY_JSON = frozenset(("{}", "", "null"))
+
+def _parse_json(s):
+    """Decode a meta/attributes blob, skipping the parser for the common empty dict."""
+    if s is None or s in _EMPTY_JSON:
+        return {}
+    return _json_loads(s)
+
+# Optional parallel similarity kernel; nearest() falls back to numpy's GEMV
+try:
+    from numba import njit, prange
+
+    @njit("float32[::1](float32[:, ::1], float32[::1])", parallel=True, fastmath=True, cache=True)
+    def _similarity_scores(mat, q):
+        # Rows of mat and q are already unit-normalized, so cosine is the dot product
+        sims = np.empty(mat.shape[0], dtype=np.float32)
+        for i in prange(mat.shape[0]):
+            dot = np.float32(0.0)
+            for j in range(mat.shape[1]):
+                dot += mat[i, j] * q[j]
+            sims[i] = dot
+        return sims
+
+    @njit("float32[::1](int8[:, ::1], float32[::1], float32[::1])", parallel=True, fastmath=True, cache=True)
+    def _int8_similarity_scores(mat, scales, q):
+        sims = np.empty(mat.shape[0], dtype=np.float32)
+        for i in prange(mat.shape[0]):
+            dot = np.float32(0.0)
+            for j in range(mat.shape[1]):
+                dot += np.float32(mat[i, j]) * q[j]
+            sims[i] = dot * scales[i]
+        return sims
+except Exception:
+    _similarity_scores = _int8_similarity_scores = None
+
+# Optional HNSW index for kinds with many vectors; smaller kinds keep the exact scan
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+ANN_MIN_VECTORS = int(os.getenv("COG_AI_ANN_MIN_VECTORS", "5000"))
+
+# "int8" keeps the in-memory search matrix as per-row scaled int8 (4x less memory traffic)
+VECTOR_QUANTIZATION = os.getenv("COG_AI_VECTOR_QUANT", "")
+_QUANT_BLOCK = 4096
+
+# Applied once per connection: WAL lets background writers and readers overlap,
+# synchronous=NORMAL drops the per-commit fsync (still durable at checkpoints)
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",
+    "PRAGMA mmap_size=268435456",
+    # INSERT OR REPLACE must fire the delete trigger that keeps kg_entities_fts in sync
+    "PRAGMA recursive_triggers=ON",
+)
+
+# One long-lived connection per thread, reopened if DB_PATH changes or after close_db()
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+_generation = 0
+
+class _Connection(sqlite3.Connection):
+    """Connection whose `with` block defers to an enclosing transaction()."""
+    
+    def __exit__(self, exc_type, exc, tb):
+        if getattr(_local, "tx_depth", 0):
+            return False
+        return super().__exit__(exc_type, exc, tb)
+
+def _connect(path):
+    # Larger statement cache: IN (...) lookups produce one distinct SQL text per arity
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False, factory=_Connection,
+                           cached_statements=256)
+    for pragma in _PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
 def get_db():
-    return sqlite3.connect(DB_PATH)
+    """Return this thread's cached connection; `with get_db() as conn` commits on exit."""
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.path != DB_PATH or _local.generation != _generation:
+        conn = _connect(DB_PATH)
+        _local.conn, _local.path, _local.generation = conn, DB_PATH, _generation
+        with _connections_lock:
+            _connections.append(conn)
+    return conn
+
+def close_db():
+    """Close every cached connection; threads reconnect on their next get_db()."""
+    global _generation
+    with _connections_lock:
+        _generation += 1
+        for conn in _connections:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        _connections.clear()
+
+atexit.register(close_db)
+
+@contextmanager
+def transaction(immediate=False):
+    """Group all storage writes on this thread into one commit.
+    
+    Nested transaction() blocks join the outermost one; helpers using
+    `with get_db()` inside it skip their own commit. `immediate` takes the
+    write lock up front (BEGIN IMMEDIATE), so a writer on another thread is
+    waited for instead of failing later with "database is locked".
+    """
+    conn = get_db()
+    depth = getattr(_local, "tx_depth", 0)
+    if depth == 0 and not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+    _local.tx_depth = depth + 1
+    try:
+        yield conn
+    except BaseException:
+        _local.tx_depth = depth
+        if depth == 0:
+            conn.rollback()
+        raise
+    _local.tx_depth = depth
+    if depth == 0:
+        conn.commit()
 
 SCHEMA_SQL = """
 CREATE TABLE IF NOT EXISTS episodic (
@@ -30,7 +168,8 @@ CREATE TABLE IF NOT EXISTS vectors (
     id INTEGER PRIMARY KEY,
     kind TEXT, -- "episodic", "semantic", "skills"
     ref_id INTEGER,
-    embedding BLOB
+    embedding BLOB,
+    dim INTEGER
 );
 CREATE TABLE IF NOT EXISTS kg_entities (
     name TEXT PRIMARY KEY,
@@ -51,11 +190,110 @@ CREATE TABLE IF NOT EXISTS meta (
     key TEXT PRIMARY KEY,
     value TEXT
 );
+CREATE TABLE IF NOT EXISTS llm_cache (
+    id INTEGER PRIMARY KEY,
+    model TEXT,
+    mode TEXT,
+    prompt TEXT,
+    response TEXT,
+    ts REAL
+);
+CREATE TABLE IF NOT EXISTS web_cache (
+    provider TEXT,
+    query TEXT,
+    max_results INTEGER,
+    results TEXT,
+    expires REAL,
+    PRIMARY KEY (provider, query, max_results)
+);
+-- (kind, ref_id) also serves kind-only lookups in nearest()
+CREATE INDEX IF NOT EXISTS idx_vectors_kind_ref ON vectors(kind, ref_id);
+CREATE INDEX IF NOT EXISTS idx_kg_relations_sp ON kg_relations(subject, predicate);
+CREATE INDEX IF NOT EXISTS idx_kg_relations_ts ON kg_relations(ts DESC);
+CREATE INDEX IF NOT EXISTS idx_kg_entities_ts ON kg_entities(ts DESC);
+CREATE INDEX IF NOT EXISTS idx_episodic_ts ON episodic(ts DESC);
+CREATE INDEX IF NOT EXISTS idx_semantic_ts ON semantic(ts DESC);
+CREATE INDEX IF NOT EXISTS idx_skills_ts ON skills(ts DESC);
 """
 
+# Trigram FTS5 index over entity names: serves search_kg_entities' substring LIKE
+# from an inverted index instead of scanning kg_entities
+FTS_SCHEMA_SQL = """
+CREATE VIRTUAL TABLE IF NOT EXISTS kg_entities_fts USING fts5(
+    name, content='kg_entities', content_rowid='rowid', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS kg_entities_fts_ai AFTER INSERT ON kg_entities BEGIN
+    INSERT INTO kg_entities_fts(rowid, name) VALUES (new.rowid, new.name);
+END;
+CREATE TRIGGER IF NOT EXISTS kg_entities_fts_ad AFTER DELETE ON kg_entities BEGIN
+    INSERT INTO kg_entities_fts(kg_entities_fts, rowid, name) VALUES ('delete', old.rowid, old.name);
+END;
+CREATE TRIGGER IF NOT EXISTS kg_entities_fts_au AFTER UPDATE ON kg_entities BEGIN
+    INSERT INTO kg_entities_fts(kg_entities_fts, rowid, name) VALUES ('delete', old.rowid, old.name);
+    INSERT INTO kg_entities_fts(rowid, name) VALUES (new.rowid, new.name);
+END;
+"""
+_fts_ready = False
+
+def _ensure_fts(conn):
+    """Create the entity FTS index if this SQLite build has FTS5 with trigrams."""
+    global _fts_ready
+    existed = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name='kg_entities_fts'"
+    ).fetchone()
+    try:
+        conn.executescript(FTS_SCHEMA_SQL)
+    except sqlite3.OperationalError:
+        _fts_ready = False
+        return
+    if not existed:
+        # Index entities written before the FTS table existed
+        conn.execute("INSERT INTO kg_entities_fts(kg_entities_fts) VALUES('rebuild')")
+    _fts_ready = True
+
+def _ensure_vector_dim(conn):
+    """Add vectors.dim to databases created before it existed; True if it was added."""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(vectors)")}
+    added = "dim" not in columns
+    if added:
+        conn.execute("ALTER TABLE vectors ADD COLUMN dim INTEGER")
+    # Lets check_vector_dimensions aggregate from the index alone
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_vectors_kind_dim ON vectors(kind, dim)")
+    return added
+
 def ensure_schema():
     with get_db() as conn:
         conn.executescript(SCHEMA_SQL)
+        _ensure_fts(conn)
+        dim_added = _ensure_vector_dim(conn)
+        # Gather planner statistics once; afterwards let SQLite refresh them as needed
+        has_stats = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name='sqlite_stat1'"
+        ).fetchone()
+        conn.execute("PRAGMA optimize" if has_stats else "ANALYZE")
+    if get_meta("vector_format") != "float32":
+        _migrate_pickled_vectors()
+        set_meta("vector_format", "float32")
+    if dim_added:
+        with get_db() as conn:
+            conn.execute("UPDATE vectors SET dim = length(embedding) / 4 WHERE dim IS NULL")
+
+_TABLES = ("episodic", "semantic", "skills", "vectors", "kg_entities", "kg_relations", "meta", "llm_cache", "web_cache")
+
+def count_rows(tables=_TABLES):
+    """Exact row counts for several tables in one statement, as {table: count}.
+    
+    Tables that don't exist (yet) count as 0 instead of raising.
+    """
+    tables = [t for t in tables if t in _TABLES]
+    counts = dict.fromkeys(tables, 0)
+    with get_db() as conn:
+        existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        tables = [t for t in tables if t in existing]
+        if tables:
+            sql = " UNION ALL ".join(f"SELECT '{t}', COUNT(*) FROM {t}" for t in tables)
+            counts.update(conn.execute(sql).fetchall())
+    return counts
 
 def get_meta(key, default=None):
     with get_db() as c:
@@ -66,6 +304,41 @@ def set_meta(key, value):
     with get_db() as c:
         c.execute("INSERT OR REPLACE INTO meta(key,value) VALUES(?,?)", (key, value))
 
+def insert_llm_cache(model, mode, prompt, response):
+    with get_db() as conn:
+        conn.execute(
+            "INSERT INTO llm_cache(model,mode,prompt,response,ts) VALUES(?,?,?,?,?)",
+            (model, mode, prompt, response, time.time())
+        )
+
+def load_llm_cache(limit=4096):
+    """Most recent (model, mode, prompt, response) rows, oldest first."""
+    with get_db() as conn:
+        rows = conn.execute(
+            "SELECT model, mode, prompt, response FROM llm_cache ORDER BY id DESC LIMIT ?",
+            (limit,)
+        ).fetchall()
+    return rows[::-1]
+
+def get_web_cache(provider, query, max_results):
+    """Unexpired raw search results for a query, or None."""
+    with get_db() as conn:
+        row = conn.execute(
+            "SELECT results FROM web_cache WHERE provider=? AND query=? AND max_results=? AND expires > ?",
+            (provider, query, max_results, time.time())
+        ).fetchone()
+    return _json_loads(row[0]) if row else None
+
+def put_web_cache(provider, query, max_results, results, ttl):
+    """Store raw search results for ttl seconds, pruning expired entries."""
+    now = time.time()
+    with get_db() as conn:
+        conn.execute("DELETE FROM web_cache WHERE expires <= ?", (now,))
+        conn.execute(
+            "INSERT OR REPLACE INTO web_cache(provider,query,max_results,results,expires) VALUES(?,?,?,?,?)",
+            (provider, query, max_results, json.dumps(results), now + ttl)
+        )
+
 def clear_vectors():
     """Clear all vectors (use when embedding dimension changes)."""
     with get_db() as conn:
@@ -76,25 +349,37 @@ def clear_vectors_by_kind(kind):
     with get_db() as conn:
         conn.execute("DELETE FROM vectors WHERE kind=?", (kind,))
 
+def _encode_vector(emb):
+    return np.ascontiguousarray(emb, dtype=np.float32).tobytes()
+
+def _decode_vector(blob):
+    return np.frombuffer(blob, dtype=np.float32)
+
+def _migrate_pickled_vectors():
+    """Rewrite legacy pickled embedding blobs as raw float32 buffers."""
+    with get_db() as conn:
+        rows = conn.execute("SELECT id, embedding FROM vectors").fetchall()
+        updates = []
+        for vid, blob in rows:
+            try:
+                v = pickle.loads(blob)
+                updates.append((_encode_vector(v), len(v), vid))
+            except Exception:
+                pass  # already a raw buffer
+        conn.executemany("UPDATE vectors SET embedding=?, dim=? WHERE id=?", updates)
+    _MAT_CACHE.clear()
+
 def check_vector_dimensions():
     """Check if all stored vectors have consistent dimensions."""
-    import numpy as np, pickle
-    dimensions = {}
     with get_db() as conn:
-        rows = conn.execute("SELECT kind, embedding FROM vectors").fetchall()
-    
-    for kind, blob in rows:
-        try:
-            v = np.array(pickle.loads(blob))
-            dim = len(v)
-            if kind not in dimensions:
-                dimensions[kind] = dim
-            elif dimensions[kind] != dim:
-                return False, f"Dimension mismatch in {kind}: {dimensions[kind]} vs {dim}"
-        except Exception as e:
-            return False, f"Error loading vector: {e}"
+        rows = conn.execute(
+            "SELECT kind, MIN(dim), MAX(dim) FROM vectors GROUP BY kind"
+        ).fetchall()
     
-    return True, dimensions
+    for kind, lo, hi in rows:
+        if lo != hi:
+            return False, f"Dimension mismatch in {kind}: {lo} vs {hi}"
+    return True, {kind: lo for kind, lo, _ in rows}
 
 def insert_episodic(role, text):
     with get_db() as conn:
@@ -104,6 +389,18 @@ def insert_episodic(role, text):
         )
         return cur.lastrowid
 
+def insert_episodic_many(rows):
+    """Insert (role, text) rows in one transaction, returning their ids in order"""
+    ts = time.time()
+    with get_db() as conn:
+        return [
+            conn.execute(
+                "INSERT INTO episodic(role,text,ts) VALUES(?,?,?)",
+                (role, text, ts)
+            ).lastrowid
+            for role, text in rows
+        ]
+
 def insert_semantic(key, value, source="agent"):
     with get_db() as conn:
         cur = conn.execute(
@@ -112,6 +409,18 @@ def insert_semantic(key, value, source="agent"):
         )
         return cur.lastrowid
 
+def insert_semantic_many(rows):
+    """Insert (key, value, source) rows in one transaction, returning their ids in order"""
+    ts = time.time()
+    with get_db() as conn:
+        return [
+            conn.execute(
+                "INSERT INTO semantic(key,value,source,ts) VALUES(?,?,?,?)",
+                (key, value, source, ts)
+            ).lastrowid
+            for key, value, source in rows
+        ]
+
 def insert_skill(note, meta=None):
     with get_db() as conn:
         cur = conn.execute(
@@ -120,45 +429,151 @@ def insert_skill(note, meta=None):
         )
         return cur.lastrowid
 
+# Decoded, row-normalized embedding matrices shared by every caller of nearest():
+# kind -> ((row count, max id), ref_ids, matrix, per-row int8 scales or None, sorted vector ids)
+_MAT_CACHE = {}
+# kind -> [hnswlib index labelled by vectors.id, dim, indexed ids, table stamp]
+_ANN_CACHE = {}
+
 def upsert_vector(kind, ref_id, emb):
-    blob = pickle.dumps(emb)
+    blob = _encode_vector(emb)
     with get_db() as conn:
         conn.execute("DELETE FROM vectors WHERE kind=? AND ref_id=?", (kind, ref_id))
         conn.execute(
-            "INSERT INTO vectors(kind,ref_id,embedding) VALUES(?,?,?)",
-            (kind, ref_id, blob)
+            "INSERT INTO vectors(kind,ref_id,embedding,dim) VALUES(?,?,?,?)",
+            (kind, ref_id, blob, len(blob) // 4)
         )
+    _MAT_CACHE.pop(kind, None)
 
-def nearest(kind, query_emb, k=5):
-    import numpy as np, pickle
+def upsert_vectors_many(kind, items):
+    """Upsert (ref_id, emb) pairs for one kind in a single transaction"""
+    if not items: return
     with get_db() as conn:
-        rows = conn.execute(
-            "SELECT ref_id, embedding FROM vectors WHERE kind=?",
+        conn.executemany(
+            "DELETE FROM vectors WHERE kind=? AND ref_id=?",
+            [(kind, ref_id) for ref_id, _ in items]
+        )
+        blobs = [(ref_id, _encode_vector(emb)) for ref_id, emb in items]
+        conn.executemany(
+            "INSERT INTO vectors(kind,ref_id,embedding,dim) VALUES(?,?,?,?)",
+            [(kind, ref_id, blob, len(blob) // 4) for ref_id, blob in blobs]
+        )
+    _MAT_CACHE.pop(kind, None)
+
+def _quantize_rows(mat):
+    """Per-row symmetric int8 quantization; returns (int8 matrix, float32 scales)."""
+    scales = np.abs(mat).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    qmat = np.rint(mat / scales[:, None]).astype(np.int8)
+    return qmat, scales.astype(np.float32)
+
+def _similarity(mat, scales, q):
+    if scales is None:
+        return _similarity_scores(mat, q) if _similarity_scores is not None else mat @ q
+    if _int8_similarity_scores is not None:
+        return _int8_similarity_scores(mat, scales, q)
+    # Dequantize a cache-sized block at a time so only int8 data streams from RAM
+    sims = np.empty(len(mat), dtype=np.float32)
+    for start in range(0, len(mat), _QUANT_BLOCK):
+        block = mat[start:start + _QUANT_BLOCK]
+        sims[start:start + len(block)] = block.astype(np.float32) @ q
+    return sims * scales
+
+def _load_vectors(kind):
+    """Return (ref_ids, matrix, scales, vec_ids) for a kind, rebuilding the matrix only when the table changed.
+    
+    Rows are zero-padded to the widest stored vector and L2-normalized once, so a
+    search is a single matrix-vector product. Each row is normalized over its own
+    full length rather than the prefix it shares with the query, so when stored
+    dimensions are mixed the cosine scores differ from a truncate-both comparison.
+    """
+    with get_db() as conn:
+        stamp = conn.execute(
+            "SELECT COUNT(*), MAX(id) FROM vectors WHERE kind=?", (kind,)
+        ).fetchone()
+        cached = _MAT_CACHE.get(kind)
+        if cached and cached[0] == stamp:
+            return cached[1:]
+        vec_ids, ref_ids, vectors = [], [], []
+        for vid, rid, blob in conn.execute(
+            "SELECT id, ref_id, embedding FROM vectors WHERE kind=? ORDER BY id",
             (kind,)
-        ).fetchall()
-    if not rows: return []
-    q = np.array(query_emb)
-    sims = []
-    for rid, blob in rows:
-        try:
-            v = np.array(pickle.loads(blob))
-            # Handle dimension mismatch by padding or truncating
-            if len(q) != len(v):
-                min_len = min(len(q), len(v))
-                q_trunc = q[:min_len]
-                v_trunc = v[:min_len]
-            else:
-                q_trunc = q
-                v_trunc = v
-            
-            denom = (np.linalg.norm(q_trunc) + 1e-9) * (np.linalg.norm(v_trunc) + 1e-9)
-            similarity = float(q_trunc @ v_trunc) / denom
-            sims.append((similarity, rid))
-        except Exception as e:
-            print(f"Error computing similarity for vector {rid}: {e}")
-            continue
-    sims.sort(reverse=True)
-    return [rid for _, rid in sims[:k]]
+        ):
+            try:
+                vectors.append(_decode_vector(blob))
+                vec_ids.append(vid)
+                ref_ids.append(rid)
+            except Exception:
+                logger.warning("Error decoding vector %s", rid, exc_info=True)
+    
+    dim = max((len(v) for v in vectors), default=0)
+    mat = np.zeros((len(vectors), dim), dtype=np.float32)
+    for i, v in enumerate(vectors):
+        mat[i, :len(v)] = v
+    mat /= np.linalg.norm(mat, axis=1, keepdims=True) + 1e-9
+    
+    scales = None
+    if VECTOR_QUANTIZATION == "int8":
+        mat, scales = _quantize_rows(mat)
+    
+    ref_ids = np.asarray(ref_ids, dtype=np.int64)
+    vec_ids = np.asarray(vec_ids, dtype=np.int64)
+    _MAT_CACHE[kind] = (stamp, ref_ids, mat, scales, vec_ids)
+    return ref_ids, mat, scales, vec_ids
+
+def _ann_index(kind, mat, scales, vec_ids):
+    """HNSW index over a kind's vectors, updated incrementally as rows are added or replaced."""
+    stamp = _MAT_CACHE[kind][0]
+    entry = _ANN_CACHE.get(kind)
+    if entry and entry[3] == stamp:
+        return entry[0]
+    dense = mat if scales is None else mat.astype(np.float32) * scales[:, None]
+    if entry is None or entry[1] != mat.shape[1]:
+        # New kind, or the embedding width changed: build from scratch
+        index = hnswlib.Index(space="ip", dim=mat.shape[1])
+        index.init_index(max_elements=max(2 * len(vec_ids), 1024), ef_construction=200, M=16,
+                         allow_replace_deleted=True)
+        index.add_items(dense, vec_ids)
+    else:
+        index, _, indexed, _ = entry
+        for label in np.setdiff1d(indexed, vec_ids, assume_unique=True):
+            index.mark_deleted(int(label))
+        new = ~np.isin(vec_ids, indexed, assume_unique=True)
+        if new.any():
+            if index.get_current_count() + int(new.sum()) > index.get_max_elements():
+                index.resize_index(2 * (index.get_current_count() + int(new.sum())))
+            index.add_items(dense[new], vec_ids[new], replace_deleted=True)
+    _ANN_CACHE[kind] = [index, mat.shape[1], vec_ids, stamp]
+    return index
+
+def nearest(kind, query_emb, k=5):
+    ref_ids, mat, scales, vec_ids = _load_vectors(kind)
+    if not len(ref_ids) or k <= 0: return []
+    
+    # Pad/truncate the query to the matrix width. Shorter rows are zero beyond
+    # their length, so the dot product covers the shared prefix, but both sides
+    # are normalized over their full length: with mixed dimensions, scores (and
+    # possibly rankings) differ from normalizing each pair over the shared prefix
+    dim = mat.shape[1]
+    q = np.zeros(dim, dtype=np.float32)
+    q_src = np.asarray(query_emb, dtype=np.float32)[:dim]
+    q[:len(q_src)] = q_src
+    q /= np.linalg.norm(q) + 1e-9
+    
+    if hnswlib is not None and len(ref_ids) >= ANN_MIN_VECTORS:
+        index = _ann_index(kind, mat, scales, vec_ids)
+        k = min(k, len(ref_ids))
+        index.set_ef(max(64, 2 * k))
+        labels, _ = index.knn_query(q, k=k)
+        return [int(rid) for rid in ref_ids[np.searchsorted(vec_ids, labels[0])]]
+    
+    sims = _similarity(mat, scales, q)
+    if k < len(sims):
+        top = np.argpartition(-sims, k)[:k]
+        top = top[np.argsort(-sims[top])]
+    else:
+        top = np.argsort(-sims)
+    return [int(rid) for rid in ref_ids[top]]
 
 def get_episodic_by_ids(ids):
     if not ids: return []
@@ -188,7 +603,26 @@ def get_skills_by_ids(ids):
             f"SELECT note, meta, ts FROM skills WHERE id IN ({placeholders})",
             ids
         ).fetchall()
-    return [(note, json.loads(meta), ts) for note, meta, ts in rows]
+    return [(note, _parse_json(meta), ts) for note, meta, ts in rows]
+
+_ROW_COLUMNS = {
+    "episodic": "role, text, ts",
+    "semantic": "key, value, source, ts",
+    "skills": "note, meta, ts",
+}
+
+def get_rows_by_ids(kind, ids):
+    """Fetch rows of a memory table keyed by id, in the same shape as get_*_by_ids"""
+    if not ids: return {}
+    with get_db() as conn:
+        placeholders = ','.join('?' * len(ids))
+        rows = conn.execute(
+            f"SELECT id, {_ROW_COLUMNS[kind]} FROM {kind} WHERE id IN ({placeholders})",
+            list(ids)
+        ).fetchall()
+    if kind == "skills":
+        return {rid: (note, _parse_json(meta), ts) for rid, note, meta, ts in rows}
+    return {row[0]: tuple(row[1:]) for row in rows}
 
 # ---- Knowledge Graph persistence ----
 def upsert_kg_entity(name, etype="entity", attributes=None):
@@ -199,6 +633,16 @@ def upsert_kg_entity(name, etype="entity", attributes=None):
             (name, etype, attrs_json, time.time())
         )
 
+def upsert_kg_entities_many(rows):
+    """Upsert (name, etype, attributes) rows in a single transaction"""
+    if not rows: return
+    ts = time.time()
+    with get_db() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO kg_entities(name, type, attributes, ts) VALUES(?,?,?,?)",
+            [(name, etype, json.dumps(attributes or {}), ts) for name, etype, attributes in rows]
+        )
+
 def upsert_kg_relation(subject, predicate, object, weight=1.0, attributes=None):
     with get_db() as conn:
         attrs_json = json.dumps(attributes or {})
@@ -208,22 +652,53 @@ def upsert_kg_relation(subject, predicate, object, weight=1.0, attributes=None):
         )
 
 def load_kg_entities():
+    """Yield (name, type, attributes, ts) rows, streaming from the cursor."""
     with get_db() as conn:
-        rows = conn.execute("SELECT name, type, attributes, ts FROM kg_entities").fetchall()
-    return [(name, etype, json.loads(attrs), ts) for name, etype, attrs, ts in rows]
+        for name, etype, attrs, ts in conn.execute("SELECT name, type, attributes, ts FROM kg_entities"):
+            yield name, etype, _parse_json(attrs), ts
 
 def load_kg_relations():
+    """Yield (subject, predicate, object, weight, attributes, ts) rows, streaming from the cursor."""
     with get_db() as conn:
-        rows = conn.execute("SELECT subject, predicate, object, weight, attributes, ts FROM kg_relations").fetchall()
-    return [(subj, pred, obj, weight, json.loads(attrs), ts) for subj, pred, obj, weight, attrs, ts in rows]
+        for subj, pred, obj, weight, attrs, ts in conn.execute(
+            "SELECT subject, predicate, object, weight, attributes, ts FROM kg_relations"
+        ):
+            yield subj, pred, obj, weight, _parse_json(attrs), ts
+
+def search_kg_neighbors(name, hops=1):
+    """Relations reachable from `name` within `hops` outgoing edges, without loading the whole graph.
+    
+    Each hop is pinned to the (subject, predicate) index so skewed ANALYZE
+    statistics can never turn the traversal into per-hop table scans.
+    """
+    with get_db() as conn:
+        rows = conn.execute(
+            """
+            WITH RECURSIVE reach(node, hop) AS (
+                VALUES(?, 0)
+                UNION
+                SELECT r.object, reach.hop + 1
+                FROM kg_relations r INDEXED BY idx_kg_relations_sp JOIN reach ON r.subject = reach.node
+                WHERE reach.hop < ?
+            )
+            SELECT DISTINCT r.subject, r.predicate, r.object, r.weight, r.attributes, r.ts
+            FROM kg_relations r INDEXED BY idx_kg_relations_sp JOIN reach ON r.subject = reach.node
+            WHERE reach.hop < ?
+            """,
+            (name, hops, hops)
+        ).fetchall()
+    return [(subj, pred, obj, weight, _parse_json(attrs), ts) for subj, pred, obj, weight, attrs, ts in rows]
 
 def search_kg_entities(query, limit=10):
     with get_db() as conn:
         rows = conn.execute(
+            "SELECT e.name, e.type, e.attributes, e.ts FROM kg_entities_fts f CROSS "
+            "JOIN kg_entities e ON e.rowid = f.rowid WHERE f.name LIKE ? LIMIT ?"
+            if _fts_ready else
             "SELECT name, type, attributes, ts FROM kg_entities WHERE name LIKE ? LIMIT ?",
             (f"%{query}%", limit)
         ).fetchall()
-    return [(name, etype, json.loads(attrs), ts) for name, etype, attrs, ts in rows]
+    return [(name, etype, _parse_json(attrs), ts) for name, etype, attrs, ts in rows]
 
 def remove_kg_relations(subject, predicate):
     """Remove existing relations with same subject and predicate"""
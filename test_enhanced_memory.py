@@ -12,6 +12,14 @@ from refactored_cognitive_agent import CognitiveAgent
 import storage
 import time
 
+# Visual pacing between interactions is opt-in so CI runs don't spend their time asleep
+SLOW_TESTS = bool(os.environ.get("SLOW_TESTS"))
+
+def pause(seconds=0.5):
+    """Brief pause between interactions when SLOW_TESTS is set"""
+    if SLOW_TESTS:
+        time.sleep(seconds)
+
 def clear_database():
     """Clear all data from the database for clean testing"""
     print("🧹 Clearing database for clean test...")
@@ -20,22 +28,16 @@ def clear_database():
     storage.ensure_schema()
     
     with storage.get_db() as conn:
-        # Clear all tables (check if they exist first)
-        tables = ["episodic", "semantic", "skills", "vectors", "kg_entities", "kg_relations", "meta"]
-        
-        for table in tables:
-            try:
-                conn.execute(f"DELETE FROM {table}")
-            except Exception as e:
-                print(f"   Note: Could not clear {table} table: {e}")
-        
-        # Reset any auto-increment counters
-        try:
-            conn.execute("DELETE FROM sqlite_sequence")
-        except:
-            pass  # Table may not exist
-        
-        conn.commit()
+        # Drop and recreate rather than DELETE: kg_entities' FTS triggers would
+        # otherwise force a row-by-row delete instead of SQLite's truncate
+        tables = ["kg_entities_fts", "episodic", "semantic", "skills", "vectors",
+                  "kg_entities", "kg_relations", "meta"]
+        conn.executescript(
+            "BEGIN;\n"
+            + "".join(f"DROP TABLE IF EXISTS {table};\n" for table in tables)
+            + "COMMIT;"
+        )
+    storage.ensure_schema()
     
     print("✅ Database cleared successfully")
 
@@ -79,7 +81,7 @@ def test_enhanced_memory_system():
         response = agent.act(user_input)
         print(f"Agent: {response}")
         print()
-        time.sleep(0.5)  # Brief pause between interactions
+        pause()  # Brief pause between interactions
     
     # Test 2: Calculator tool result storage
     print("🧪 Test 2: Calculator Tool Results")
@@ -95,7 +97,7 @@ def test_enhanced_memory_system():
         response = agent.act(user_input)
         print(f"Agent: {response}")
         print()
-        time.sleep(0.5)
+        pause()
     
     # Test 3: Memory retrieval and effectiveness
     print("🧪 Test 3: Memory Retrieval & Effectiveness")
@@ -114,7 +116,7 @@ def test_enhanced_memory_system():
         response = agent.act(user_input)
         print(f"Agent: {response}")
         print()
-        time.sleep(0.5)
+        pause()
     
     # Test 3b: Test implicit relationship learning
     print("🧪 Test 3b: Implicit Relationship Learning")
@@ -131,28 +133,31 @@ def test_enhanced_memory_system():
         response = agent.act(user_input)
         print(f"Agent: {response}")
         print()
-        time.sleep(0.5)
+        pause()
     
     # Test 4: Check database contents
     print("🧪 Test 4: Database Analysis")
     print("-" * 30)
     
+    agent.flush()
+    # All table counts in one statement
+    counts = storage.count_rows(("episodic", "semantic", "skills", "kg_entities", "kg_relations"))
     with storage.get_db() as conn:
         # Check episodic memories
-        episodic_count = conn.execute("SELECT COUNT(*) FROM episodic").fetchone()[0]
+        episodic_count = counts["episodic"]
         print(f"📝 Episodic memories: {episodic_count}")
         
         # Check semantic facts
-        semantic_count = conn.execute("SELECT COUNT(*) FROM semantic").fetchone()[0]
+        semantic_count = counts["semantic"]
         print(f"🧠 Semantic facts: {semantic_count}")
         
         # Check skills
-        skills_count = conn.execute("SELECT COUNT(*) FROM skills").fetchone()[0]
+        skills_count = counts["skills"]
         print(f"🎯 Skills/patterns: {skills_count}")
         
         # Check KG entities and relations
-        kg_entities_count = conn.execute("SELECT COUNT(*) FROM kg_entities").fetchone()[0]
-        kg_relations_count = conn.execute("SELECT COUNT(*) FROM kg_relations").fetchone()[0]
+        kg_entities_count = counts["kg_entities"]
+        kg_relations_count = counts["kg_relations"]
         print(f"🕸️  KG entities: {kg_entities_count}")
         print(f"🔗 KG relations: {kg_relations_count}")
         
@@ -209,6 +214,7 @@ def test_memory_consolidation():
     for i in range(12):
         user_input = f"This is interaction number {i+1}"
         agent.act(user_input)
+    agent.flush()
     
     # Check if reflection was created
     with storage.get_db() as conn:
@@ -235,6 +241,7 @@ def test_fact_updating():
     # Update the fact
     print("Updating fact...")
     agent.act("Actually, my favorite food is now sushi")
+    agent.flush()
     
     # Check if both versions exist
     with storage.get_db() as conn:
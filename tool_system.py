@@ -5,6 +5,9 @@ import re
 import ast
 import operator
 import json
+import itertools
+from collections import OrderedDict
+from functools import lru_cache
 
 class Tool(ABC):
     """Base class for all tools"""
@@ -31,15 +34,45 @@ class Tool(ABC):
         """Execute the tool and return results"""
         pass
 
+_OPS = {
+    ast.Add: operator.add, ast.Sub: operator.sub,
+    ast.Mult: operator.mul, ast.Div: operator.truediv,
+    ast.Pow: operator.pow, ast.USub: operator.neg
+}
+
+# Node types a calculator expression may contain; anything else is rejected before eval
+_ALLOWED_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Constant) + tuple(_OPS)
+
+@lru_cache(maxsize=1024)
+def _safe_eval(expr: str):
+    """Safely evaluate a mathematical expression; repeated expressions skip parsing"""
+    tree = ast.parse(expr, mode='eval')
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED_NODES):
+            raise ValueError("Unsupported expression")
+        if isinstance(node, ast.Constant) and (
+            type(node.value) not in (int, float, complex)
+        ):
+            raise ValueError("Unsupported expression")
+    # Validated to arithmetic on numeric literals only, so CPython can run it directly
+    return eval(compile(tree, '<calc>', 'eval'), {"__builtins__": {}}, {})
+
 class CalculatorTool(Tool):
     """Mathematical calculator tool"""
     
-    def __init__(self):
-        self.ops = {
-            ast.Add: operator.add, ast.Sub: operator.sub,
-            ast.Mult: operator.mul, ast.Div: operator.truediv,
-            ast.Pow: operator.pow, ast.USub: operator.neg
-        }
+    # One pass over the input. Each alternative scans the whole text (lazy .*?) before the
+    # next is tried, so a binary expression anywhere still beats an earlier parenthesised
+    # number. A power expression is already a binop ("^" is in its operator class).
+    _MATH_RE = re.compile(
+        r'.*?(?P<binop>\d+(?:\.\d+)?\s*[\+\-\*/\^%]\s*\d+(?:\.\d+)?(?:\s*[\+\-\*/\^%]\s*\d+(?:\.\d+)?)*)'
+        r'|.*?(?P<paren>\(\s*\d+(?:\.\d+)?(?:\s*[\+\-\*/\^%]\s*\d+(?:\.\d+)?)*\s*\))',
+        re.DOTALL
+    )
+    # Every match (and the fallback) needs a digit or an operator
+    _MATH_CHARS = frozenset("0123456789+-*/^%")
+    _CLEAN_RE = re.compile(r'[^\d\+\-\*/\^%\(\)\.]')
+    
+    ops = _OPS
     
     @property
     def name(self) -> str:
@@ -55,19 +88,15 @@ class CalculatorTool(Tool):
     
     def _extract_math_expression(self, text: str) -> Optional[str]:
         """Extract math expression from text"""
-        patterns = [
-            r'(\d+(?:\.\d+)?\s*[\+\-\*/\^%]\s*\d+(?:\.\d+)?(?:\s*[\+\-\*/\^%]\s*\d+(?:\.\d+)?)*)',
-            r'(\(\s*\d+(?:\.\d+)?(?:\s*[\+\-\*/\^%]\s*\d+(?:\.\d+)?)*\s*\))',
-            r'(\d+(?:\.\d+)?\s*\^\s*\d+(?:\.\d+)?)',
-        ]
+        if self._MATH_CHARS.isdisjoint(text) and (text.isascii() or not any(ch.isdigit() for ch in text)):
+            return None
         
-        for pattern in patterns:
-            match = re.search(pattern, text)
-            if match:
-                return match.group(1).strip()
+        match = self._MATH_RE.match(text)
+        if match:
+            return match.group(match.lastgroup).strip()
         
         # Fallback: clean the text and try to eval
-        cleaned = re.sub(r'[^\d\+\-\*/\^%\(\)\.]', '', text)
+        cleaned = self._CLEAN_RE.sub('', text)
         if cleaned and any(op in cleaned for op in '+-*/^%'):
             return cleaned
             
@@ -75,17 +104,7 @@ class CalculatorTool(Tool):
     
     def _safe_eval(self, expr: str):
         """Safely evaluate mathematical expressions"""
-        def _eval(node):
-            if isinstance(node, ast.Num): 
-                return node.n
-            if isinstance(node, ast.BinOp): 
-                return self.ops[type(node.op)](_eval(node.left), _eval(node.right))
-            if isinstance(node, ast.UnaryOp): 
-                return self.ops[type(node.op)](_eval(node.operand))
-            raise ValueError("Unsupported expression")
-        
-        tree = ast.parse(expr, mode='eval').body
-        return _eval(tree)
+        return _safe_eval(expr)
     
     def execute(self, user_input: str, context: Dict[str, Any]) -> Dict[str, Any]:
         """Execute mathematical calculation"""
@@ -107,8 +126,18 @@ class CalculatorTool(Tool):
 class KnowledgeGraphTool(Tool):
     """Knowledge graph query tool"""
     
-    def __init__(self, kg):
+    QUERY_INDICATORS = (
+        "what do you know", "tell me about", "my favorite", 
+        "what is my", "who is", "where do i", "do i like"
+    )
+    # One pass over the input for all indicators, without a lowercased copy
+    _INDICATOR_RE = re.compile("|".join(re.escape(i) for i in QUERY_INDICATORS), re.IGNORECASE)
+    
+    def __init__(self, kg, cache_size: int = 256):
         self.kg = kg
+        # user_input -> (kg.version, result); entries from an older graph version are misses
+        self._exact_cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self.cache_size = cache_size
     
     @property
     def name(self) -> str:
@@ -120,39 +149,45 @@ class KnowledgeGraphTool(Tool):
     
     def can_handle(self, user_input: str, context: Dict[str, Any]) -> bool:
         """Check if input is asking about stored knowledge"""
-        query_indicators = [
-            "what do you know", "tell me about", "my favorite", 
-            "what is my", "who is", "where do i", "do i like"
-        ]
-        user_lower = user_input.lower()
-        return any(indicator in user_lower for indicator in query_indicators)
+        return self._INDICATOR_RE.search(user_input) is not None
     
     def execute(self, user_input: str, context: Dict[str, Any]) -> Dict[str, Any]:
         """Query the knowledge graph"""
+        version = getattr(self.kg, "version", None)
+        cached = self._exact_cache.get(user_input)
+        if cached is not None and version is not None and cached[0] == version:
+            self._exact_cache.move_to_end(user_input)
+            return cached[1]
+        
+        result = self._query(user_input)
+        if result.get("success") and version is not None:
+            self._exact_cache[user_input] = (version, result)
+            self._exact_cache.move_to_end(user_input)
+            if len(self._exact_cache) > self.cache_size:
+                self._exact_cache.popitem(last=False)
+        return result
+    
+    def _query(self, user_input: str) -> Dict[str, Any]:
+        """Search the graph and assemble entity results"""
         try:
             entities = self.kg.search_entities(user_input, limit=5)
             if not entities:
                 return {"success": True, "entities": [], "message": "No matching entities found"}
             
+            infos = self.kg.get_entities_info_bulk(entities)
+            related_by_entity = self.kg.get_related_concepts_bulk(infos, max_out=3)
+            
             results = []
-            for entity in entities:
-                info = self.kg.get_entity_info(entity)
-                if info:
-                    entity_data = {
-                        "name": entity,
-                        "type": info['type'],
-                        "relations": []
-                    }
-                    
-                    # Get related concepts
-                    related = self.kg.get_related_concepts(entity, max_out=3)
-                    for rel_entity, relation in related:
-                        entity_data["relations"].append({
-                            "relation": relation,
-                            "target": rel_entity
-                        })
-                    
-                    results.append(entity_data)
+            for entity, info in infos.items():
+                entity_data = {
+                    "name": entity,
+                    "type": info['type'],
+                    "relations": [
+                        {"relation": relation, "target": rel_entity}
+                        for rel_entity, relation in related_by_entity[entity]
+                    ]
+                }
+                results.append(entity_data)
             
             # Generate a more helpful response
             if results:
@@ -163,10 +198,8 @@ class KnowledgeGraphTool(Tool):
                     relations = entity_data["relations"]
                     
                     if relations:
-                        relation_text = []
-                        for rel in relations:
-                            relation_text.append(f"{rel['relation']} {rel['target']}")
-                        response_parts.append(f"{name} ({entity_type}): {', '.join(relation_text)}")
+                        relation_text = ", ".join(f"{rel['relation']} {rel['target']}" for rel in relations)
+                        response_parts.append(f"{name} ({entity_type}): {relation_text}")
                     else:
                         response_parts.append(f"{name} ({entity_type})")
                 
@@ -184,33 +217,38 @@ class KnowledgeGraphTool(Tool):
 class ToolRegistry:
     """Registry for managing tools"""
     
-    def __init__(self):
-        self.tools: Dict[str, Tool] = {}
-        self.tool_order: List[str] = []  # For priority ordering
+    def __init__(self, route_cache_size: int = 512):
+        # Iteration order is priority order (higher first, ties in registration order)
+        self.tools: "OrderedDict[str, Tool]" = OrderedDict()
+        self._order_keys: Dict[str, tuple] = {}  # name -> (-priority, registration seq)
+        self._seq = itertools.count()
+        # user_input -> routed tool name (None if no tool matched); no built-in
+        # can_handle looks at context, so routing depends on the text alone
+        self._route_cache: "OrderedDict[str, Optional[str]]" = OrderedDict()
+        self.route_cache_size = route_cache_size
     
     def register(self, tool: Tool, priority: int = 0):
         """Register a tool with optional priority"""
+        if tool.name in self.tools:
+            self.unregister(tool.name)
+        key = (-priority, next(self._seq))
+        self._order_keys[tool.name] = key
         self.tools[tool.name] = tool
         
-        # Insert based on priority (higher priority first)
-        inserted = False
-        for i, existing_name in enumerate(self.tool_order):
-            if priority > getattr(self.tools[existing_name], 'priority', 0):
-                self.tool_order.insert(i, tool.name)
-                inserted = True
-                break
-        
-        if not inserted:
-            self.tool_order.append(tool.name)
+        # Insert based on priority: tools that sort after the new one move behind it
+        for name in [name for name in self.tools if self._order_keys[name] > key]:
+            self.tools.move_to_end(name)
         
         # Store priority on tool for future reference
         tool.priority = priority
+        self._route_cache.clear()
     
     def unregister(self, tool_name: str):
         """Remove a tool from registry"""
         if tool_name in self.tools:
             del self.tools[tool_name]
-            self.tool_order.remove(tool_name)
+            del self._order_keys[tool_name]
+            self._route_cache.clear()
     
     def get_tool(self, tool_name: str) -> Optional[Tool]:
         """Get a specific tool by name"""
@@ -218,11 +256,22 @@ class ToolRegistry:
     
     def find_best_tool(self, user_input: str, context: Dict[str, Any]) -> Optional[Tool]:
         """Find the best tool to handle the input"""
-        for tool_name in self.tool_order:
-            tool = self.tools[tool_name]
+        cache = self._route_cache
+        if user_input in cache:
+            cache.move_to_end(user_input)
+            cached_name = cache[user_input]
+            return self.tools[cached_name] if cached_name is not None else None
+        
+        best = None
+        for tool in self.tools.values():
             if tool.can_handle(user_input, context):
-                return tool
-        return None
+                best = tool
+                break
+        
+        cache[user_input] = best.name if best is not None else None
+        if len(cache) > self.route_cache_size:
+            cache.popitem(last=False)
+        return best
     
     def list_tools(self) -> List[Dict[str, str]]:
         """List all registered tools"""
@@ -234,8 +283,7 @@ class ToolRegistry:
     def get_tool_descriptions(self) -> str:
         """Get formatted tool descriptions for the planner"""
         descriptions = []
-        for tool_name in self.tool_order:
-            tool = self.tools[tool_name]
+        for tool in self.tools.values():
             descriptions.append(f"- {tool.name}: {tool.description}")
         return "\n".join(descriptions)
 
@@ -1,12 +1,105 @@
 
-import requests
+import asyncio
+import heapq
 import json
+import logging
+import os
 import re
+import string
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
 from typing import Dict, Any, List, Optional
+import storage
 from tool_system import Tool
 from dataclasses import dataclass
-from datetime import datetime
-from ddgs import DDGS
+from functools import cached_property
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# orjson parses LLM-extracted fact arrays several times faster when available
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    _json_loads = json.loads
+
+# Phrases that signal a web search is needed, matched as plain substrings in one pass
+_SEARCH_INDICATORS = (
+    # Explicit search requests
+    "search for", "look up", "find information about", "search the web",
+    "google", "find online", "search online",
+
+    # Current/recent information requests
+    "latest", "recent", "current", "today", "this week", "this month",
+    "what's happening", "news about", "updates on",
+
+    # Time-sensitive queries
+    "price of", "stock price", "weather", "forecast", "schedule",
+    "when is", "what time", "how much does", "cost of",
+
+    # Real-time data requests
+    "trending", "popular", "viral", "breaking news",
+
+    # Information likely not in stored knowledge
+    "reviews of", "compare", "vs", "versus", "best", "top",
+    "how to", "tutorial", "guide", "instructions"
+)
+_INDICATOR_RE = re.compile("|".join(map(re.escape, _SEARCH_INDICATORS)))
+
+# Question shapes that typically need fresh data, matched against lowercased input in one pass
+_QUESTION_RE = re.compile("|".join(f"(?:{p})" for p in (
+    r"what (?:is|are) the (?:latest|current|recent)",
+    r"who (?:won|is|are) (?:the|this|last)",
+    r"when (?:is|was|will) (?:the|this|next)",
+    r"how much (?:does|is|are|costs?)",
+    r"where (?:is|can i|to)",
+)))
+# Leading search phrases stripped from queries; longest first so "search for" beats "search"
+_PREFIX_RE = re.compile("|".join(map(re.escape, sorted((
+    "search for", "look up", "find information about", "search the web for",
+    "google", "find", "search", "tell me about", "what is", "what are",
+    "how much", "when is", "where is", "who is"
+), key=len, reverse=True))), re.IGNORECASE)
+_ARTICLE_RE = re.compile(r'^(the|a|an)\s+', re.IGNORECASE)
+_WHATS_RE = re.compile(r'\bwhats\b', re.IGNORECASE)
+_WHERES_RE = re.compile(r'\bwheres\b', re.IGNORECASE)
+_WHOS_RE = re.compile(r'\bwhos\b', re.IGNORECASE)
+_WHENS_RE = re.compile(r'\bwhens\b', re.IGNORECASE)
+
+# Words dropped from news queries before re-phrasing them as "<subject> news today"
+_NEWS_STOP_WORDS = frozenset({
+    'news', 'about', 'summarize', 'summerize', 'what', 'you', 'see',
+    'search', 'for', 'latest', 'recent', 'today'
+})
+_RECENCY_RE = re.compile("|".join(map(re.escape, (
+    'current', 'latest', 'recent', 'today', 'now', 'this week', 'this month'
+))))
+
+# Hosts whose results get a relevance bonus: these sites and their subdomains, plus
+# .edu/.gov hosts (including country forms such as .gov.uk)
+_AUTHORITATIVE_HOST_RE = re.compile(
+    r"(?:^|\.)(?:(?:%s)|(?:edu|gov)(?:\.[a-z]{2})?)$" % "|".join(map(re.escape, (
+        "wikipedia.org", "reuters.com", "bbc.com", "npr.org",
+        "cnn.com", "nytimes.com", "wsj.com"
+    )))
+)
+
+# Cache-key normalization: case, spacing and most punctuation don't change what a search
+# engine returns, but symbols that name things (c++, c#, at&t, $, %) are kept
+_CACHE_KEY_PUNCT = str.maketrans("", "", "".join(c for c in string.punctuation if c not in "+#&$%"))
+_WHITESPACE_RE = re.compile(r"\s+")
+
+def _canonicalize_query(query: str) -> str:
+    """Canonical form of a search query for cache keys"""
+    return _WHITESPACE_RE.sub(" ", query.lower().translate(_CACHE_KEY_PUNCT)).strip()
+
+# Seconds a provider's raw results for a query stay reusable
+WEB_CACHE_TTL = float(os.getenv("COG_AI_WEB_CACHE_TTL", "120"))
+# Seconds results persist in the SQLite web_cache table across restarts (0 disables)
+WEB_DISK_CACHE_TTL = float(os.getenv("COG_AI_WEB_DISK_TTL", "3600"))
 
 
 @dataclass
@@ -17,13 +110,32 @@ class SearchResult:
     snippet: str
     relevance_score: float = 0.0
     timestamp: Optional[str] = None
+    
+    @cached_property
+    def title_words(self) -> frozenset:
+        """Lowercased title tokens, computed once per result"""
+        return frozenset(self.title.lower().split())
+    
+    @cached_property
+    def snippet_words(self) -> frozenset:
+        """Lowercased snippet tokens, computed once per result"""
+        return frozenset(self.snippet.lower().split())
 
 class WebSearchTool(Tool):
     """Enhanced web search tool with multiple providers and result processing"""
     
-    def __init__(self, search_provider="duckduckgo", max_results=5):
+    def __init__(self, search_provider="duckduckgo", max_results=5, cache_size=256, cache_ttl=WEB_CACHE_TTL,
+                 disk_cache_ttl=WEB_DISK_CACHE_TTL):
         self.search_provider = search_provider
         self.max_results = max_results
+        # (provider, query, max_results) -> (expires_at, raw results), least recently used first
+        self._result_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._cache_lock = threading.Lock()
+        self.disk_cache_ttl = disk_cache_ttl
+        # DDGS client created on first search and reused so its HTTP connections stay alive
+        self._ddgs = None
         
         # Configure search providers
         self.providers = {
@@ -42,45 +154,15 @@ class WebSearchTool(Tool):
     
     def can_handle(self, user_input: str, context: Dict[str, Any]) -> bool:
         """Check if input requires web search"""
-        search_indicators = [
-            # Explicit search requests
-            "search for", "look up", "find information about", "search the web",
-            "google", "find online", "search online",
-            
-            # Current/recent information requests
-            "latest", "recent", "current", "today", "this week", "this month",
-            "what's happening", "news about", "updates on",
-            
-            # Time-sensitive queries
-            "price of", "stock price", "weather", "forecast", "schedule",
-            "when is", "what time", "how much does", "cost of",
-            
-            # Real-time data requests
-            "trending", "popular", "viral", "breaking news",
-            
-            # Information likely not in stored knowledge
-            "reviews of", "compare", "vs", "versus", "best", "top",
-            "how to", "tutorial", "guide", "instructions"
-        ]
-        
         user_lower = user_input.lower()
         
         # Check for explicit indicators
-        if any(indicator in user_lower for indicator in search_indicators):
+        if _INDICATOR_RE.search(user_lower):
             return True
         
         # Check for question patterns that typically need fresh data
-        question_patterns = [
-            r"what (?:is|are) the (?:latest|current|recent)",
-            r"who (?:won|is|are) (?:the|this|last)",
-            r"when (?:is|was|will) (?:the|this|next)",
-            r"how much (?:does|is|are|costs?)",
-            r"where (?:is|can i|to)",
-        ]
-        
-        for pattern in question_patterns:
-            if re.search(pattern, user_lower):
-                return True
+        if _QUESTION_RE.search(user_lower):
+            return True
         
         return False
     
@@ -94,73 +176,145 @@ class WebSearchTool(Tool):
             if not search_provider_func:
                 return {"success": False, "error": f"Unknown search provider: {self.search_provider}"}
             
-            raw_results = search_provider_func(search_query)
-            
-            if not raw_results:
-                return {
-                    "success": True,
-                    "query": search_query,
-                    "results": [],
-                    "message": f"No search results found for: {search_query}"
-                }
+            raw_results = self._cached_search(search_provider_func, search_query)
+            return self._build_response(search_query, raw_results, user_input)
             
-            # Process and rank results
-            processed_results = self._process_results(raw_results, user_input)
+        except Exception as e:
+            print(f"Debug: Web search error: {e}")
+            return {"success": False, "error": str(e)}
+    
+    async def execute_async(self, user_input: str, context: Dict[str, Any]) -> Dict[str, Any]:
+        """Like execute, but awaits the provider call in a worker thread so the event loop stays free"""
+        try:
+            search_query = self._extract_search_query(user_input)
+            search_provider_func = self.providers.get(self.search_provider)
+            if not search_provider_func:
+                return {"success": False, "error": f"Unknown search provider: {self.search_provider}"}
             
-            # Generate summary
-            summary = self._generate_summary(processed_results, user_input)
+            raw_results = await asyncio.to_thread(self._cached_search, search_provider_func, search_query)
+            return self._build_response(search_query, raw_results, user_input)
             
+        except Exception as e:
+            print(f"Debug: Web search error: {e}")
+            return {"success": False, "error": str(e)}
+    
+    def _build_response(self, search_query: str, raw_results: List[Dict], user_input: str) -> Dict[str, Any]:
+        """Rank raw provider results and package them as a tool result"""
+        if not raw_results:
             return {
                 "success": True,
                 "query": search_query,
-                "results": processed_results,
-                "summary": summary,
-                "message": f"Found {len(processed_results)} results for: {search_query}"
+                "results": [],
+                "message": f"No search results found for: {search_query}"
             }
-            
-        except Exception as e:
-            print(f"Debug: Web search error: {e}")
-            return {"success": False, "error": str(e)}
+        
+        # Process and rank results
+        processed_results = self._process_results(raw_results, user_input)
+        
+        # Generate summary
+        summary = self._generate_summary(processed_results, user_input)
+        
+        return {
+            "success": True,
+            "query": search_query,
+            "results": processed_results,
+            "summary": summary,
+            "message": f"Found {len(processed_results)} results for: {search_query}"
+        }
+    
+    def batch_execute(self, inputs: List[str], context: Optional[Dict[str, Any]] = None,
+                      max_workers: int = 8) -> List[Dict[str, Any]]:
+        """Execute several searches concurrently, returning results in input order.
+        
+        Identical inputs are searched once and share a result.
+        """
+        context = context or {}
+        unique = list(dict.fromkeys(inputs))
+        if len(unique) <= 1:
+            results = [self.execute(user_input, context) for user_input in unique]
+        else:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(unique)),
+                                    thread_name_prefix="web-search") as executor:
+                results = list(executor.map(lambda user_input: self.execute(user_input, context), unique))
+        by_input = dict(zip(unique, results))
+        return [by_input[user_input] for user_input in inputs]
+    
+    def _cached_search(self, search_provider_func, search_query: str) -> List[Dict]:
+        """Run a provider search, checking the in-memory LRU, then the on-disk cache, then the network"""
+        # Variants like "Weather NYC?" and "weather  nyc" share an entry; the provider still gets search_query
+        key = (self.search_provider, _canonicalize_query(search_query), self.max_results)
+        now = time.monotonic()
+        with self._cache_lock:
+            cached = self._result_cache.get(key)
+            if cached is not None and cached[0] > now:
+                self._result_cache.move_to_end(key)
+                return cached[1]
+        
+        raw_results = self._disk_cache_get(key)
+        if raw_results is None:
+            raw_results = search_provider_func(search_query)
+            # Empty results are usually provider errors; retry those next time
+            if raw_results:
+                self._disk_cache_put(key, raw_results)
+        if raw_results and self.cache_ttl > 0:
+            with self._cache_lock:
+                self._result_cache[key] = (now + self.cache_ttl, raw_results)
+                self._result_cache.move_to_end(key)
+                if len(self._result_cache) > self.cache_size:
+                    self._result_cache.popitem(last=False)
+        return raw_results
+    
+    def _disk_cache_get(self, key: tuple) -> Optional[List[Dict]]:
+        """Persisted results for a cache key, or None when missing, expired, or unavailable"""
+        if self.disk_cache_ttl <= 0:
+            return None
+        try:
+            return storage.get_web_cache(*key)
+        except Exception:
+            # No schema yet (or a locked database): behave like a miss
+            return None
+    
+    def _disk_cache_put(self, key: tuple, raw_results: List[Dict]):
+        """Persist results for a cache key; failures only cost a future miss"""
+        if self.disk_cache_ttl <= 0:
+            return
+        try:
+            storage.put_web_cache(*key, raw_results, self.disk_cache_ttl)
+        except Exception:
+            logger.warning("Web search cache write error", exc_info=True)
     
     def _extract_search_query(self, user_input: str) -> str:
         """Extract clean search query from user input"""
         # Remove common search prefixes
         query = user_input
-        prefixes_to_remove = [
-            "search for", "look up", "find information about", "search the web for",
-            "google", "find", "search", "tell me about", "what is", "what are",
-            "how much", "when is", "where is", "who is"
-        ]
-        
-        query_lower = query.lower()
-        for prefix in prefixes_to_remove:
-            if query_lower.startswith(prefix):
-                query = query[len(prefix):].strip()
-                break
+        match = _PREFIX_RE.match(query)
+        if match:
+            query = query[match.end():].strip()
         
         # Clean up the query
-        query = re.sub(r'^(the|a|an)\s+', '', query, flags=re.IGNORECASE)
+        query = _ARTICLE_RE.sub('', query)
         query = query.strip('?.,!').strip()
         
         # Fix common contractions and improve weather queries
-        query = re.sub(r'\bwhats\b', 'what is', query, flags=re.IGNORECASE)
-        query = re.sub(r'\bwheres\b', 'where is', query, flags=re.IGNORECASE)
-        query = re.sub(r'\bwhos\b', 'who is', query, flags=re.IGNORECASE)
-        query = re.sub(r'\bwhens\b', 'when is', query, flags=re.IGNORECASE)
+        query = _WHATS_RE.sub('what is', query)
+        query = _WHERES_RE.sub('where is', query)
+        query = _WHOS_RE.sub('who is', query)
+        query = _WHENS_RE.sub('when is', query)
         
         # For weather queries, make them more specific and add location context
-        if 'weather' in query.lower():
-            if 'new york' in query.lower() or 'nyc' in query.lower():
+        query_lower = query.lower()
+        if 'weather' in query_lower:
+            if 'new york' in query_lower or 'nyc' in query_lower:
                 query = "New York City weather forecast today"
             else:
                 query = f"current weather forecast {query}"
+            query_lower = query.lower()
         
         # For news queries, make them more specific and recent
-        if 'news' in query.lower() or 'summarize' in query.lower() or 'summerize' in query.lower():
+        if 'news' in query_lower or 'summarize' in query_lower or 'summerize' in query_lower:
             # Extract the main subject from the query and make it more searchable
             # Remove common words that don't help with search
-            stop_words = {'news', 'about', 'summarize', 'summerize', 'what', 'you', 'see', 'search', 'for', 'latest', 'recent', 'today'}
-            words = [word for word in query.lower().split() if word not in stop_words]
+            words = [word for word in query_lower.split() if word not in _NEWS_STOP_WORDS]
             
             if words:
                 # Reconstruct query with key terms and add recency indicators
@@ -171,53 +325,54 @@ class WebSearchTool(Tool):
                 query = "latest news today"
         
         # For current/recent information queries, add recency indicators
-        elif any(word in query.lower() for word in ['current', 'latest', 'recent', 'today', 'now', 'this week', 'this month']):
+        elif _RECENCY_RE.search(query_lower):
             # Add recency indicators to make search more effective
-            if not any(word in query.lower() for word in ['news', 'weather']):
+            if 'news' not in query_lower and 'weather' not in query_lower:
                 query = f"{query} today"
         
         return query if query else user_input
     
     def _process_results(self, raw_results: List[Dict], user_input: str) -> List[SearchResult]:
-        """Process and rank search results"""
+        """Process and rank search results, keeping the top max_results"""
         processed = []
+        user_words = set(user_input.lower().split())
+        seen_urls = set()
         
-        for result in raw_results[:self.max_results]:
+        for result in raw_results:
+            # Skip repeats of a URL (ignoring #fragments); results without one are always kept
+            url_key = (result.get("href") or result.get("url") or "").split("#", 1)[0]
+            if url_key:
+                if url_key in seen_urls:
+                    continue
+                seen_urls.add(url_key)
             search_result = SearchResult(
                 title=result.get("title", ""),
                 url=result.get("href", ""),  # DuckDuckGo uses 'href' not 'url'
                 snippet=result.get("body", ""),  # DuckDuckGo uses 'body' not 'snippet'
-                relevance_score=self._calculate_relevance(result, user_input),
                 timestamp=result.get("timestamp")
             )
+            search_result.relevance_score = self._calculate_relevance(search_result, user_words)
             processed.append(search_result)
         
-        # Sort by relevance score
-        processed.sort(key=lambda x: x.relevance_score, reverse=True)
-        return processed
+        # Top-K by relevance score (stable, same order as a full descending sort)
+        return heapq.nlargest(self.max_results, processed, key=lambda x: x.relevance_score)
     
-    def _calculate_relevance(self, result: Dict, user_input: str) -> float:
-        """Calculate relevance score for a search result"""
+    def _calculate_relevance(self, result: SearchResult, user_words: set) -> float:
+        """Calculate relevance score for a search result against the user's lowercased words"""
         score = 0.0
-        user_words = set(user_input.lower().split())
         
         # Title relevance
-        title_words = set(result.get("title", "").lower().split())
-        title_overlap = len(user_words.intersection(title_words))
-        score += title_overlap * 0.4
+        score += len(user_words & result.title_words) * 0.4
         
-        # Snippet relevance (DuckDuckGo uses 'body' not 'snippet')
-        snippet_words = set(result.get("body", "").lower().split())
-        snippet_overlap = len(user_words.intersection(snippet_words))
-        score += snippet_overlap * 0.3
+        # Snippet relevance
+        score += len(user_words & result.snippet_words) * 0.3
         
         # Domain authority (simple heuristic)
-        url = result.get("href", "")  # DuckDuckGo uses 'href' not 'url'
-        authoritative_domains = [
-            "wikipedia.org", "edu", "gov", "reuters.com", "bbc.com",
-            "npr.org", "cnn.com", "nytimes.com", "wsj.com"
-        ]
-        if any(domain in url for domain in authoritative_domains):
+        try:
+            host = urlsplit(result.url).hostname or ""
+        except ValueError:
+            host = ""
+        if _AUTHORITATIVE_HOST_RE.search(host):
             score += 0.3
         
         return score
@@ -256,8 +411,11 @@ class WebSearchTool(Tool):
     def _duckduckgo_search(self, query: str) -> List[Dict]:
         """Search using DuckDuckGo (via ddgs library)"""
         try:
-            ddgs = DDGS()
-            results = ddgs.text(query, max_results=self.max_results)
+            if self._ddgs is None:
+                # Imported on first search so agent startup doesn't pay for the HTTP stack
+                from ddgs import DDGS
+                self._ddgs = DDGS()
+            results = self._ddgs.text(query, max_results=self.max_results)
             return results
         except Exception as e:
             print(f"DuckDuckGo search error: {e}")
@@ -286,24 +444,7 @@ class WebSearchTool(Tool):
             print(f"Serper search error: {e}")
             return []
 
-class WebSearchKnowledgeExtractor:
-    """Extract knowledge from web search results"""
-    
-    def __init__(self, llm_caller):
-        self.llm_caller = llm_caller
-    
-    def extract_facts_from_results(self, search_results: List[SearchResult], user_query: str) -> List[Dict[str, Any]]:
-        """Extract structured facts from search results"""
-        if not search_results:
-            return []
-        
-        # Combine top results into context
-        context = "\n".join([
-            f"Title: {result.title}\nContent: {result.snippet}\nSource: {result.url}"
-            for result in search_results[:3]
-        ])
-        
-        prompt = f"""Extract factual information from these search results. Return ONLY a JSON array.
+_FACT_EXTRACTION_PROMPT = """Extract factual information from these search results. Return ONLY a JSON array.
 Each fact should have: entity, type, relation, target, and source_url.
 
 User query: "{user_query}"
@@ -317,7 +458,19 @@ Extract facts that directly answer the user's question. Focus on:
 - Recent events or updates
 
 JSON array:"""
+
+class WebSearchKnowledgeExtractor:
+    """Extract knowledge from web search results"""
+    
+    def __init__(self, llm_caller):
+        self.llm_caller = llm_caller
+    
+    def extract_facts_from_results(self, search_results: List[SearchResult], user_query: str) -> List[Dict[str, Any]]:
+        """Extract structured facts from search results"""
+        if not search_results:
+            return []
         
+        prompt = self._build_prompt(search_results, user_query)
         try:
             response = self.llm_caller(prompt, mode="answer")
             return self._parse_json_response(response)
@@ -325,14 +478,48 @@ JSON array:"""
             print(f"Web search knowledge extraction error: {e}")
             return []
     
+    async def extract_facts_from_results_async(self, search_results: List[SearchResult], user_query: str,
+                                               timeout: float = 15.0) -> List[Dict[str, Any]]:
+        """Like extract_facts_from_results, but awaits the LLM in a worker thread, giving up after timeout seconds"""
+        if not search_results:
+            return []
+        
+        prompt = self._build_prompt(search_results, user_query)
+        try:
+            response = await asyncio.wait_for(
+                asyncio.to_thread(self.llm_caller, prompt, mode="answer"), timeout=timeout
+            )
+            return self._parse_json_response(response)
+        except asyncio.TimeoutError:
+            logger.warning("Web search knowledge extraction timed out after %ss", timeout)
+            return []
+        except Exception:
+            logger.warning("Web search knowledge extraction error", exc_info=True)
+            return []
+    
+    def _build_prompt(self, search_results: List[SearchResult], user_query: str) -> str:
+        """Fill the extraction prompt with the top three results"""
+        context = "\n".join(
+            f"Title: {result.title}\nContent: {result.snippet}\nSource: {result.url}"
+            for result in search_results[:3]
+        )
+        return _FACT_EXTRACTION_PROMPT.format(user_query=user_query, context=context)
+    
     def _parse_json_response(self, response: str) -> List[Dict[str, Any]]:
         """Parse JSON response with fallback"""
+        # Fast path: the model returned a bare JSON array, so skip the bracket scan
+        try:
+            facts = _json_loads(response)
+            if isinstance(facts, list):
+                return facts
+        except Exception:
+            pass
         try:
             json_start = response.find('[')
             json_end = response.rfind(']') + 1
             if json_start >= 0 and json_end > json_start:
                 json_str = response[json_start:json_end]
-                facts = json.loads(json_str)
+                facts = _json_loads(json_str)
                 return facts if isinstance(facts, list) else []
         except Exception:
             pass